@@ -1,20 +1,79 @@
+import codecs
+import contextlib
 import csv
+import errno
+import fnmatch
+import glob
+import heapq
 import os
+import posixpath
 import shutil
-import tkinter as tk
-from tkinter import filedialog, messagebox, simpledialog
+import sys
+import threading
+import time
+from collections import deque
+
+
+class _Logger:
+    """The "ImageSelector" logger, with logging imported on the first message."""
+
+    def __getattr__(self, name):
+        import logging
+        return getattr(logging.getLogger("ImageSelector"), name)
+
+
+logger = _Logger()
+
+STATE_FOLDER = os.path.join(os.path.expanduser("~"), ".imageselector")
+DEFAULT_HISTORY_PATH = os.path.join(STATE_FOLDER, "history.sqlite")
+DEFAULT_WARM_START_PATH = os.path.join(STATE_FOLDER, "warm-start.json")
+
+# tkinter is imported on first use, through these module attributes or inside
+# the GUI functions; argparse, logging, json, hashlib, concurrent.futures and
+# the profiling/history modules are imported by the functions that need them.
+# A headless run, or the import itself, does not pay for what it never uses.
+_LAZY_MODULES = {
+    "tk": "tkinter",
+    "filedialog": "tkinter.filedialog",
+    "messagebox": "tkinter.messagebox",
+    "simpledialog": "tkinter.simpledialog",
+}
+
+
+def __getattr__(name):
+    if name in _LAZY_MODULES:
+        import importlib
+        module = importlib.import_module(_LAZY_MODULES[name])
+        globals()[name] = module
+        return module
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 # GUI to select files/folders
-def select_csv():
+def select_csv(initialdir=None):
+    from tkinter import filedialog
+
+    options = {"initialdir": initialdir} if initialdir else {}
     return filedialog.askopenfilename(
         title="Select the CSV file",
-        filetypes=[("CSV files", "*.csv")]
+        filetypes=[("CSV files", "*.csv")],
+        **options
     )
 
 
-def select_folder(title):
-    return filedialog.askdirectory(title=title)
+def select_folder(title, initialdir=None):
+    from tkinter import filedialog
+
+    options = {"initialdir": initialdir} if initialdir else {}
+    return filedialog.askdirectory(title=title, **options)
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2
 
 
 def detect_delimiter(sample_line):
@@ -28,115 +87,1859 @@ def detect_delimiter(sample_line):
         return ','  # fallback
 
 
-def main():
+# Longest BOMs first: the UTF-32-LE BOM starts with the UTF-16-LE one
+BOM_ENCODINGS = (
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+
+
+def detect_encoding(path, sample_size=64 * 1024):
+    """Guess the CSV encoding from its first bytes only.
+
+    BOMs win; BOM-less UTF-16 is recognised by its NUL bytes; otherwise the
+    sample must decode as UTF-8, with cp1252 (or latin-1 for bytes cp1252
+    leaves undefined) as the Windows fallback.
+    """
+    with open(path, 'rb') as f:
+        sample = f.read(sample_size)
+        complete = len(sample) < sample_size or not f.read(1)
+
+    for bom, encoding in BOM_ENCODINGS:
+        if sample.startswith(bom):
+            return encoding
+
+    even_nuls = sample[0::2].count(0)
+    odd_nuls = sample[1::2].count(0)
+    if len(sample) >= 2 and max(even_nuls, odd_nuls) > len(sample) // 4:
+        return 'utf-16-le' if odd_nuls > even_nuls else 'utf-16-be'
+
+    try:
+        # A multi-byte character may be cut at the end of the sample
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=complete)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        pass
+    try:
+        sample.decode('cp1252')
+        return 'cp1252'
+    except UnicodeDecodeError:
+        return 'latin-1'
+
+
+def positive_int(value):
+    import argparse
+
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected a whole number, got '{value}'")
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number
+
+
+def positive_seconds(value):
+    import argparse
+
+    try:
+        seconds = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected a number of seconds, got '{value}'")
+    if not seconds > 0:
+        raise argparse.ArgumentTypeError(f"must be greater than 0, got {value}")
+    return seconds
+
+
+def parse_quality(value):
+    import argparse
+
+    number = positive_int(value)
+    if number > 100:
+        raise argparse.ArgumentTypeError(f"must be between 1 and 100, got {number}")
+    return number
+
+
+def parse_shard(value):
+    """Parse `--shard i/N` into (i, N), with 1 <= i <= N."""
+    import argparse
+
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected i/N, got '{value}'")
+    if count < 1 or not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(f"shard index must be between 1 and N, got '{value}'")
+    return index, count
+
+
+def parse_args(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Copy the images listed in a CSV file to a destination folder."
+    )
+    parser.add_argument(
+        "--preserve-structure", action="store_true",
+        help="keep the relative subfolders of the CSV paths under the destination"
+    )
+    parser.add_argument(
+        "--separator", metavar="SEP",
+        help="split each image cell on SEP, for cells listing several images (e.g. '|')"
+    )
+    parser.add_argument(
+        "--workers", type=positive_int, metavar="N",
+        help="copy with exactly N parallel workers instead of tuning the count"
+    )
+    parser.add_argument(
+        "--max-workers", type=positive_int, default=32, metavar="N",
+        help="upper bound for the tuned number of parallel copies (default: 32)"
+    )
+    parser.add_argument(
+        "--source", metavar="FOLDER_OR_URL",
+        help="folder or s3://bucket/prefix of the original photos (skips the folder dialog)"
+    )
+    parser.add_argument(
+        "--destination", metavar="FOLDER_OR_URL",
+        help="destination folder or s3://bucket/prefix (skips the folder dialog)"
+    )
+    parser.add_argument(
+        "--sync", action="store_true",
+        help="copy only images that are new or changed in the destination (size and mtime)"
+    )
+    parser.add_argument(
+        "--sync-hash", action="store_true",
+        help="with --sync, compare same-size files by content hash instead of mtime"
+    )
+    parser.add_argument(
+        "--prune", choices=("remove", "quarantine"),
+        help="with --sync, remove or quarantine destination images that are not in the CSV"
+    )
+    parser.add_argument(
+        "--max-size", type=positive_int, metavar="PX",
+        help="write resized images (longest side at most PX) instead of copying the originals"
+    )
+    parser.add_argument(
+        "--format", choices=sorted(TransformSettings.EXTENSIONS),
+        help="re-encode the selected images in this format (default with --max-size: jpeg)"
+    )
+    parser.add_argument(
+        "--quality", type=parse_quality, default=85, metavar="Q",
+        help="encoder quality from 1 to 100 for --max-size/--format (default: 85)"
+    )
+    parser.add_argument(
+        "--timeout", type=positive_seconds, default=60.0, metavar="SECONDS",
+        help="give up on a file after SECONDS without any progress (default: 60)"
+    )
+    parser.add_argument(
+        "--retries", type=int, default=3, metavar="N",
+        help="retry transient copy errors up to N times with exponential backoff (default: 3)"
+    )
+    parser.add_argument(
+        "--report", metavar="PATH",
+        help="stream one record per image to PATH (.csv for CSV, anything else for JSON Lines)"
+    )
+    parser.add_argument(
+        "--warm-start", nargs="?", const=DEFAULT_WARM_START_PATH, metavar="PATH",
+        help="remember the dialog answers and an index of the photo folder between runs "
+             f"(default path: {DEFAULT_WARM_START_PATH})"
+    )
+    parser.add_argument(
+        "--history", nargs="?", const=DEFAULT_HISTORY_PATH, metavar="PATH",
+        help="record the run in a SQLite history used for ETA predictions "
+             f"(default path: {DEFAULT_HISTORY_PATH})"
+    )
+    parser.add_argument(
+        "--profile", metavar="DIR",
+        help="write per-stage cProfile (.prof) and tracemalloc summaries into DIR"
+    )
+    parser.add_argument(
+        "--shard", type=parse_shard, metavar="i/N",
+        help="copy only the i-th of N disjoint subsets of the images (1-based)"
+    )
+    parser.add_argument(
+        "--merge-shards", metavar="DESTINATION",
+        help="combine the shard journals found in DESTINATION into one report and exit"
+    )
+    return parser.parse_args([] if argv is None else argv)
+
+
+def normalize_reference(value, preserve_structure=False):
+    """Turn a CSV cell into the path copied relative to both photo and destination folders.
+
+    Returns None for cells that cannot be used (empty, or escaping the photo folder).
+    """
+    value = value.strip()
+    if not value:
+        return None
+    if not preserve_structure:
+        return os.path.basename(value) or None
+
+    # CSV exports mix Windows and POSIX separators: normalize to POSIX first
+    value = value.replace('\\', '/')
+    if len(value) >= 2 and value[1] == ':':
+        value = value[2:]  # drop a drive letter
+    relpath = posixpath.normpath(value.lstrip('/'))
+    if relpath in ('.', '') or relpath == '..' or relpath.startswith('../'):
+        return None
+    return relpath.replace('/', os.sep)
+
+
+def find_collisions(relpaths, target=None):
+    """Group the paths that would land on the same destination file.
+
+    `target` maps a path to the file actually written (e.g. a new extension).
+    Destinations are compared case-insensitively because the copy may target
+    a Windows or macOS volume even when the CSV lists both spellings.
+    """
+    groups = {}
+    for relpath in relpaths:
+        destination = target(relpath) if target else relpath
+        groups.setdefault(os.path.normcase(destination).casefold(), set()).add(relpath)
+    return sorted(sorted(group) for group in groups.values() if len(group) > 1)
+
+
+class DirectoryCache:
+    """Memoizes the destination directories already known to exist.
+
+    Each directory costs at most one mkdir per run, however many files it holds.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.normpath(root)
+        self._known = {self.root}
+        self.mkdir_calls = 0
+
+    def ensure(self, directory):
+        directory = os.path.normpath(directory)
+        if directory in self._known:
+            return
+        parent = os.path.dirname(directory)
+        if parent != directory:
+            self.ensure(parent)
+        try:
+            os.mkdir(directory)
+            self.mkdir_calls += 1
+        except FileExistsError:
+            pass
+        self._known.add(directory)
+
+
+def resolve_columns(fieldnames, file_name_column):
+    """Map a comma-separated list of column names or patterns (`image*`) to CSV headers.
+
+    Matching is case-insensitive; each entry must match at least one header.
+    A header that itself contains a comma (`Foto, principale`) is matched
+    as a whole before the answer is split.
+    """
+    # Case-insensitive header matching
+    header_map = {col.lstrip('\ufeff').strip().lower(): col for col in fieldnames or []}
+    whole = file_name_column.strip().lower()
+    if whole in header_map:
+        return [header_map[whole]]
+    columns = []
+    for requested in file_name_column.split(','):
+        requested_col = requested.strip().lower()
+        if not requested_col:
+            continue
+        if requested_col in header_map:
+            matches = [header_map[requested_col]]
+        else:
+            matches = [col for key, col in header_map.items() if fnmatch.fnmatchcase(key, requested_col)]
+        if not matches:
+            raise ValueError(f"Column '{requested.strip()}' not found in CSV.")
+        columns.extend(col for col in matches if col not in columns)
+    if not columns:
+        raise ValueError(f"Column '{file_name_column}' not found in CSV.")
+    return columns
+
+
+def iter_references(csv_file, file_name_column, preserve_structure=False, separator=None):
+    """Yield the (row number, image path) pairs of the CSV, in file order.
+
+    Every matching column of a row is read, and with `separator` each cell
+    may hold several images (`a.jpg|b.jpg`); rows are expanded as they are read.
+    """
+    with open(csv_file, newline='', encoding=detect_encoding(csv_file)) as f:
+
+        first_line = f.readline()
+        f.seek(0)  # torna all'inizio del file
+        delimiter = detect_delimiter(first_line)
+        reader = csv.DictReader(f, delimiter=delimiter)
+        columns = resolve_columns(reader.fieldnames, file_name_column)
+
+        for row in reader:
+            for column in columns:
+                value = row.get(column)
+                if not value:
+                    continue
+                for part in value.split(separator) if separator else (value,):
+                    name = normalize_reference(part, preserve_structure)
+                    if name:
+                        yield reader.line_num, name
+
+
+def dedupe_references(references):
+    """Map each image path to the first CSV row that references it."""
+    photo_names = {}
+    for row_number, name in references:
+        photo_names.setdefault(name, row_number)
+    return photo_names
+
+
+def read_photo_names(csv_file, file_name_column, preserve_structure=False, separator=None):
+    return dedupe_references(
+        iter_references(csv_file, file_name_column, preserve_structure, separator)
+    )
+
+
+class StageProfiler:
+    """Times the stages of a run and, given a directory, profiles each of them.
+
+    Every stage writes `<stage>.prof` (open it with pstats or snakeviz) and
+    `<stage>-allocations.txt` with the peak traced memory and the top
+    allocation sites. cProfile only sees the calling thread, so the copy
+    stage mostly shows time spent waiting on the worker pool.
+    """
+
+    def __init__(self, directory=None, top=25):
+        self.directory = directory
+        self.top = top
+        self.durations = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        if not self.directory:
+            try:
+                yield
+            finally:
+                self.durations[name] = time.perf_counter() - started
+            return
+
+        import cProfile
+        import tracemalloc
+
+        os.makedirs(self.directory, exist_ok=True)
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot()
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            self.durations[name] = time.perf_counter() - started
+            _, peak = tracemalloc.get_traced_memory()
+            after = tracemalloc.take_snapshot()
+            if started_tracing:
+                tracemalloc.stop()
+            profile.dump_stats(os.path.join(self.directory, f"{name}.prof"))
+            self._write_allocations(name, peak, after.compare_to(before, 'lineno'))
+
+    def _write_allocations(self, name, peak, differences):
+        path = os.path.join(self.directory, f"{name}-allocations.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(f"Stage: {name}\n")
+            f.write(f"Duration: {self.durations[name]:.3f} s\n")
+            f.write(f"Peak traced memory: {peak / 1024 / 1024:.1f} MiB\n\n")
+            f.write(f"Top {self.top} allocation sites (growth during the stage):\n")
+            for difference in differences[:self.top]:
+                f.write(f"{difference}\n")
+
+
+class ConcurrencyTuner:
+    """Picks the number of parallel copies from the throughput of each batch.
+
+    Concurrency doubles while MB/s or files/s keep improving, halves when the
+    median per-file latency spikes, and then stays at the best count seen.
+    """
+
+    def __init__(self, initial=2, maximum=32, pinned=None,
+                 growth_threshold=1.05, latency_factor=2.0):
+        if pinned is not None and pinned < 1:
+            raise ValueError(f"pinned worker count must be at least 1, got {pinned}")
+        self.workers = pinned if pinned is not None else min(initial, maximum)
+        self.maximum = maximum
+        self.settled = pinned is not None
+        self.growth_threshold = growth_threshold
+        self.latency_factor = latency_factor
+        self.best = None  # (workers, mb_per_s, files_per_s, median_latency)
+
+    def batch_size(self):
+        return self.workers * 8
+
+    def record(self, files, nbytes, elapsed, latencies):
+        if self.settled or not files or elapsed <= 0:
+            return
+        mb_per_s = nbytes / elapsed / 1e6
+        files_per_s = files / elapsed
+        latency = median(latencies) if latencies else 0.0
+
+        if self.best is None:
+            self.best = (self.workers, mb_per_s, files_per_s, latency)
+        elif self.best[3] and latency > self.best[3] * self.latency_factor:
+            self._settle(max(1, self.workers // 2), "latency spike")
+            return
+        elif (mb_per_s > self.best[1] * self.growth_threshold
+              or files_per_s > self.best[2] * self.growth_threshold):
+            self.best = (self.workers, mb_per_s, files_per_s, latency)
+        else:
+            self._settle(self.best[0], "throughput stopped improving")
+            return
+
+        if self.workers >= self.maximum:
+            self._settle(self.workers, "reached --max-workers")
+        else:
+            self.workers = min(self.workers * 2, self.maximum)
+
+    def _settle(self, workers, reason):
+        self.workers = workers
+        self.settled = True
+        _, mb_per_s, files_per_s, _ = self.best
+        logger.info(
+            "Copy concurrency settled at %d workers (%s; best %.1f MB/s, %.0f files/s). "
+            "Pin it with --workers %d.",
+            workers, reason, mb_per_s, files_per_s, workers
+        )
+
+
+class SelectionResult:
+    def __init__(self):
+        self.copied = 0
+        self.skipped = 0
+        self.not_found = []
+        self.failed = []  # (photo_name, reason)
+        self.bytes_copied = 0
+        self.total_names = 0
+        self.copy_names = 0  # images handed to the copy stage, the basis of throughput
+        self.workers = None
+        self.phases = {}
+        self.warning = None
+        self.sync_plan = None
+        self.cancelled = False
+
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+class CopyAbandoned(Exception):
+    """Raised inside a copy thread once the scheduler has given up on its attempt."""
+
+
+class CopyAttempt:
+    """Progress of one copy attempt, shared by its thread and the scheduler.
+
+    The copy calls heartbeat() after every chunk; a timeout is measured from
+    the last heartbeat, so a large file on a slow link is never cut short
+    while it keeps moving.
+    """
+
+    def __init__(self):
+        self.started = self.last_progress = time.monotonic()
+        self.abandoned = False
+
+    def heartbeat(self):
+        if self.abandoned:
+            raise CopyAbandoned()
+        self.last_progress = time.monotonic()
+
+
+def copy_stream(f, out, heartbeat=None):
+    for chunk in iter(lambda: f.read(COPY_CHUNK_SIZE), b""):
+        out.write(chunk)
+        if heartbeat:
+            heartbeat()
+
+
+def copy_file(src, dst, heartbeat=None):
+    """Copy data and metadata like shutil.copy2, calling heartbeat() after every chunk."""
+    with open(src, "rb") as f, open(dst, "wb") as out:
+        copy_stream(f, out, heartbeat)
+    shutil.copystat(src, dst)
+
+
+def partial_path(path):
+    # Unique per attempt, so an abandoned attempt never writes into a retry's file
+    return f"{path}.{os.urandom(4).hex()}.part"
+
+
+class LocalStorage:
+    """A plain folder, usable as source or destination."""
+
+    def __init__(self, root):
+        self.root = root
+        self.directories = DirectoryCache(root)
+
+    def __str__(self):
+        return self.root
+
+    def local_path(self, name):
+        return os.path.join(self.root, name)
+
+    def location(self, name):
+        return self.local_path(name)
+
+    def exists(self, name):
+        # Unlike os.path.exists, only a missing file means False: an EIO or
+        # ESTALE from a dropped share must reach the retry and circuit breaker
+        try:
+            os.stat(self.local_path(name))
+        except (FileNotFoundError, NotADirectoryError):
+            return False
+        return True
+
+    def open(self, name):
+        return open(self.local_path(name), "rb")
+
+    def put(self, name, source, heartbeat=None):
+        """Copy `name` from the source backend; returns (status, bytes).
+
+        The data goes to a private partial file that replaces the destination
+        only once complete, so readers and retries never see a torn copy.
+        """
+        dst = self.local_path(name)
+        self.directories.ensure(os.path.dirname(dst))
+        partial = partial_path(dst)
+        try:
+            src = source.local_path(name)
+            if src:
+                copy_file(src, partial, heartbeat)
+            else:
+                with contextlib.closing(source.open(name)) as f, open(partial, "wb") as out:
+                    copy_stream(f, out, heartbeat)
+            if heartbeat:
+                heartbeat()  # an abandoned attempt must not replace a retry's copy
+            os.replace(partial, dst)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(partial)
+            raise
+        return "copied", os.path.getsize(dst)
+
+
+class S3Storage:
+    """An S3 (or S3-compatible) bucket prefix, usable as source or destination.
+
+    One client is shared by every copy thread; its connection pool is sized
+    to the maximum number of workers. Files above `part_size` are sent as
+    multipart uploads, and an object whose ETag already matches the source
+    file is not uploaded again. Part size and threshold default to the AWS
+    CLI values so ETags of objects it uploaded compare equal.
+    """
+
+    MISSING_CODES = {"404", "NoSuchKey", "NotFound"}
+
+    def __init__(self, bucket, prefix="", client=None, pool_size=10, part_size=8 * 1024 * 1024):
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.part_size = part_size
+        if client is None:
+            try:
+                import boto3
+                from botocore.config import Config
+            except ImportError:
+                raise RuntimeError("S3 storage requires boto3 (pip install boto3).")
+            client = boto3.client("s3", config=Config(max_pool_connections=pool_size))
+        self.client = client
+
+    def __str__(self):
+        return f"s3://{self.bucket}/{self.prefix}"
+
+    def key(self, name):
+        name = name.replace(os.sep, "/")
+        return f"{self.prefix}/{name}" if self.prefix else name
+
+    def local_path(self, name):
+        return None
+
+    def location(self, name):
+        return f"s3://{self.bucket}/{self.key(name)}"
+
+    def head(self, name):
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self.key(name))
+        except Exception as e:
+            code = getattr(e, "response", {}).get("Error", {}).get("Code")
+            if code in self.MISSING_CODES:
+                return None
+            raise
+
+    def exists(self, name):
+        return self.head(name) is not None
+
+    def open(self, name):
+        return self.client.get_object(Bucket=self.bucket, Key=self.key(name))["Body"]
+
+    def etag_of(self, path):
+        """The ETag S3 gives `path` when uploaded with this part size."""
+        import hashlib
+
+        digests = []
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(self.part_size), b""):
+                digests.append(hashlib.md5(chunk))
+        if len(digests) <= 1:
+            return (digests[0] if digests else hashlib.md5()).hexdigest()
+        combined = hashlib.md5(b"".join(digest.digest() for digest in digests))
+        return f"{combined.hexdigest()}-{len(digests)}"
+
+    def put(self, name, source, heartbeat=None):
+        """Upload `name` from the source backend; returns (status, bytes)."""
+        src = source.local_path(name)
+        if not src:
+            # Stream remote-to-remote copies through a local temporary file
+            import tempfile
+
+            with contextlib.closing(source.open(name)) as f, tempfile.TemporaryFile() as spool:
+                copy_stream(f, spool, heartbeat)
+                size = spool.tell()
+                spool.seek(0)
+                self._upload(name, spool, size, heartbeat)
+                return "copied", size
+
+        size = os.path.getsize(src)
+        existing = self.head(name)
+        if (existing and existing.get("ContentLength") == size
+                and existing.get("ETag", "").strip('"') == self.etag_of(src)):
+            return "skipped", 0
+        with open(src, "rb") as f:
+            self._upload(name, f, size, heartbeat)
+        return "copied", size
+
+    def _upload(self, name, f, size, heartbeat=None):
+        key = self.key(name)
+        if size <= self.part_size:
+            self.client.put_object(Bucket=self.bucket, Key=key, Body=f.read())
+            return
+        upload_id = self.client.create_multipart_upload(Bucket=self.bucket, Key=key)["UploadId"]
+        try:
+            parts = []
+            for number, chunk in enumerate(iter(lambda: f.read(self.part_size), b""), 1):
+                response = self.client.upload_part(
+                    Bucket=self.bucket, Key=key, UploadId=upload_id, PartNumber=number, Body=chunk
+                )
+                parts.append({"ETag": response["ETag"], "PartNumber": number})
+                if heartbeat:
+                    heartbeat()
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket, Key=key, UploadId=upload_id, MultipartUpload={"Parts": parts}
+            )
+        except BaseException:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id)
+            raise
+
+
+def open_storage(location, pool_size=10):
+    """Backend for a folder path or an s3://bucket/prefix URL; backends pass through."""
+    if not isinstance(location, str):
+        return location
+    if location.startswith("s3://"):
+        bucket, _, prefix = location[len("s3://"):].partition("/")
+        return S3Storage(bucket, prefix, pool_size=pool_size)
+    return LocalStorage(location)
+
+
+def copy_one(source, destination, name, heartbeat=None, known_present=False):
+    """Copy a single image; returns (status, bytes, seconds).
+
+    With `known_present` the existence check is skipped; if the source is
+    gone after all, the copy fails to open it and the image is still
+    reported as not found.
+    """
+    started = time.perf_counter()
+    if not known_present and not source.exists(name):
+        return "not_found", 0, time.perf_counter() - started
+    try:
+        status, size = destination.put(name, source, heartbeat)
+    except FileNotFoundError:
+        if not known_present or source.exists(name):
+            raise
+        return "not_found", 0, time.perf_counter() - started
+    return status, size, time.perf_counter() - started
+
+
+TRANSIENT_ERRNOS = {
+    getattr(errno, name) for name in (
+        "EIO", "EAGAIN", "EBUSY", "ETIMEDOUT", "ECONNRESET", "ECONNABORTED",
+        "ENETDOWN", "ENETUNREACH", "EHOSTDOWN", "EHOSTUNREACH", "ESTALE",
+    ) if hasattr(errno, name)
+}
+# Windows reports dropped SMB shares through winerror only
+TRANSIENT_WINERRORS = {53, 64, 121}  # path not found, name deleted, semaphore timeout
+# botocore network errors do not derive from OSError; matched by name so
+# that boto3 stays optional
+TRANSIENT_BOTOCORE_ERRORS = {
+    "ConnectTimeoutError", "ReadTimeoutError", "EndpointConnectionError", "ConnectionClosedError",
+}
+
+
+def is_transient(error):
+    if isinstance(error, TimeoutError):
+        return True
+    if any(cls.__name__ in TRANSIENT_BOTOCORE_ERRORS and cls.__module__.startswith("botocore")
+           for cls in type(error).__mro__):
+        return True
+    return isinstance(error, OSError) and (
+        error.errno in TRANSIENT_ERRNOS
+        or getattr(error, "winerror", None) in TRANSIENT_WINERRORS
+    )
+
+
+class RetryPolicy:
+    def __init__(self, retries=3, timeout=60.0, backoff=0.5):
+        self.retries = retries
+        self.timeout = timeout
+        self.backoff = backoff
+
+    def delay(self, attempt):
+        return self.backoff * 2 ** attempt
+
+
+class CircuitBreaker:
+    """Pauses the run when the source keeps failing, and gives up if it stays down.
+
+    After `threshold` consecutive transient failures the run sleeps for
+    `cooldown` seconds, then lets a single failure re-open the breaker.
+    After `max_trips` pauses without a success in between, `broken` is set
+    and the remaining files are reported as failed.
+    """
+
+    def __init__(self, threshold=5, cooldown=30.0, max_trips=3, sleep=time.sleep):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.max_trips = max_trips
+        self.sleep = sleep
+        self.failures = 0
+        self.trips = 0
+        self.broken = False
+
+    def success(self):
+        self.failures = 0
+        self.trips = 0
+
+    def failure(self):
+        self.failures += 1
+        if self.failures < self.threshold or self.broken:
+            return
+        self.trips += 1
+        if self.trips > self.max_trips:
+            self.broken = True
+            logger.error("Source still failing after %d pauses, giving up on the remaining files.",
+                         self.max_trips)
+            return
+        logger.warning("%d consecutive copy failures, pausing %.0f s (pause %d of %d).",
+                       self.failures, self.cooldown, self.trips, self.max_trips)
+        self.sleep(self.cooldown)
+        self.failures = self.threshold - 1  # half-open: one more failure trips again
+
+
+def copy_photos(photo_names, photo_folder, destination_folder, tuner=None,
+                result=None, progress=None, on_result=None, policy=None, breaker=None,
+                present=()):
+    """Copy the named images.
+
+    progress(done, total) is called after every measurement window of the
+    tuner and on_result(photo_name, status, nbytes, seconds, reason) once per image, both from
+    the calling thread. Every attempt runs in its own daemon thread: one that
+    makes no progress for the policy timeout is abandoned (it stops at its
+    next chunk, and a truly hung call cannot keep the process alive) and
+    retried like any transient error. Folders may be paths or storage backends;
+    images in `present` are known to exist and are not checked before the copy.
+    """
+    from concurrent.futures import FIRST_COMPLETED, Future, wait
+
+    source = open_storage(photo_folder)
+    destination = open_storage(destination_folder)
+    tuner = tuner or ConcurrencyTuner()
+    result = result or SelectionResult()
+    policy = policy or RetryPolicy()
+    breaker = breaker or CircuitBreaker()
+
+    finished = 0
+
+    def start(photo_name):
+        attempt = CopyAttempt()
+        future = Future()
+
+        def run():
+            future.set_running_or_notify_cancel()
+            try:
+                future.set_result(copy_one(
+                    source, destination, photo_name, attempt.heartbeat, photo_name in present
+                ))
+            except BaseException as e:
+                future.set_exception(e)
+
+        threading.Thread(target=run, name=f"copy {photo_name}", daemon=True).start()
+        return future, attempt
+
+    def fail(photo_name, reason, seconds=0.0):
+        nonlocal finished
+        finished += 1
+        result.failed.append((photo_name, reason))
+        if on_result:
+            on_result(photo_name, "failed", 0, seconds, reason)
+
+    pending = list(photo_names)
+    position = 0
+    ready = deque()  # (photo_name, retry number) of retries that are due
+    backing_off = []  # heap of (retry_at, photo_name, retry number)
+    running = {}  # future -> (photo_name, retry number, CopyAttempt)
+
+    # The tuner measures windows of batch_size() results; files waiting on a
+    # timeout or a retry never hold back the files after them
+    window_size = tuner.batch_size()
+    window_started = time.perf_counter()
+    window_results = 0
+    nbytes = 0
+    latencies = []
+
+    def close_window():
+        nonlocal window_size, window_started, window_results, nbytes, latencies
+        result.bytes_copied += nbytes
+        tuner.record(len(latencies), nbytes, time.perf_counter() - window_started, latencies)
+        if progress:
+            progress(finished, len(pending))
+        window_size = tuner.batch_size()
+        window_started = time.perf_counter()
+        window_results = nbytes = 0
+        latencies = []
+
+    while position < len(pending) or ready or backing_off or running:
+        now = time.monotonic()
+        while backing_off and backing_off[0][0] <= now:
+            _, photo_name, retry = heapq.heappop(backing_off)
+            ready.append((photo_name, retry))
+        if breaker.broken:
+            reason = "source unavailable (circuit breaker open)"
+            for photo_name, _, attempt in running.values():
+                attempt.abandoned = True
+                fail(photo_name, reason)
+            for photo_name, _ in ready:
+                fail(photo_name, reason)
+            for _, photo_name, _ in backing_off:
+                fail(photo_name, reason)
+            for photo_name in pending[position:]:
+                fail(photo_name, reason)
+            break
+        while (ready or position < len(pending)) and len(running) < tuner.workers:
+            if ready:
+                photo_name, retry = ready.popleft()
+            else:
+                photo_name, retry = pending[position], 0
+                position += 1
+            future, attempt = start(photo_name)
+            running[future] = (photo_name, retry, attempt)
+
+        deadlines = [attempt.last_progress + policy.timeout for _, _, attempt in running.values()]
+        if backing_off:
+            deadlines.append(backing_off[0][0])
+        wait_for = max(0.0, min(deadlines) - now) if deadlines else policy.timeout
+        done, _ = wait(running, timeout=wait_for, return_when=FIRST_COMPLETED)
+
+        errors = []
+        for future in done:
+            photo_name, retry, attempt = running.pop(future)
+            try:
+                status, size, seconds = future.result()
+            except Exception as e:
+                errors.append((photo_name, retry, e, time.monotonic() - attempt.started))
+                continue
+            breaker.success()
+            finished += 1
+            window_results += 1
+            if status == "copied":
+                result.copied += 1
+                nbytes += size
+                latencies.append(seconds)
+            elif status == "skipped":
+                result.skipped += 1
+            else:
+                result.not_found.append(photo_name)
+            if on_result:
+                on_result(photo_name, status, size, seconds, None)
+
+        now = time.monotonic()
+        for future, (photo_name, retry, attempt) in list(running.items()):
+            if now - attempt.last_progress >= policy.timeout:
+                # Threads cannot be interrupted: the attempt stops at its next heartbeat
+                attempt.abandoned = True
+                del running[future]
+                errors.append((photo_name, retry, TimeoutError(
+                    f"no progress for {policy.timeout:.0f} s"
+                ), now - attempt.started))
+
+        for photo_name, retry, error, seconds in errors:
+            transient = is_transient(error)
+            if transient:
+                breaker.failure()
+            if transient and retry < policy.retries:
+                logger.info("Retrying %s after %s", photo_name, error)
+                heapq.heappush(
+                    backing_off, (time.monotonic() + policy.delay(retry), photo_name, retry + 1)
+                )
+            else:
+                fail(photo_name, str(error) or type(error).__name__, seconds)
+                window_results += 1
+
+        if window_results >= window_size:
+            close_window()
+
+    if window_results:
+        close_window()
+    result.workers = tuner.workers
+    return result
+
+
+JOURNAL_FOLDER = ".imageselector"
+
+
+class TransformSettings:
+    """Parameters of the optional resize/re-encode stage, which needs Pillow."""
+
+    EXTENSIONS = {"jpeg": ".jpg", "webp": ".webp"}
+
+    def __init__(self, max_size=None, image_format="jpeg", quality=85):
+        self.max_size = max_size
+        self.image_format = image_format
+        self.quality = quality
+
+    @classmethod
+    def from_options(cls, options):
+        if not options.max_size and not options.format:
+            return None
+        return cls(options.max_size, options.format or "jpeg", options.quality)
+
+    def output_name(self, photo_name):
+        return os.path.splitext(photo_name)[0] + self.EXTENSIONS[self.image_format]
+
+    def cache_key(self, stat):
+        return f"{stat.st_mtime_ns}:{stat.st_size}:{self.max_size}:{self.image_format}:{self.quality}"
+
+
+_process_directories = {}
+
+
+def transform_one(src, dst, destination_folder, settings, cached_key):
+    """Resize/re-encode one image in a worker process.
+
+    Returns (status, bytes, cache key, seconds, error message).
+    """
+    started = time.perf_counter()
+    try:
+        status, nbytes, key = _transform(src, dst, destination_folder, settings, cached_key)
+        return status, nbytes, key, time.perf_counter() - started, None
+    except Exception as e:
+        return "failed", 0, None, time.perf_counter() - started, str(e) or type(e).__name__
+
+
+def _transform(src, dst, destination_folder, settings, cached_key):
+    try:
+        key = settings.cache_key(os.stat(src))
+    except FileNotFoundError:
+        return "not_found", 0, None
+    if key == cached_key and os.path.exists(dst):
+        return "skipped", 0, key
+
+    from PIL import Image, ImageOps
+
+    directories = _process_directories.setdefault(
+        destination_folder, DirectoryCache(destination_folder)
+    )
+    directories.ensure(os.path.dirname(dst))
+    with Image.open(src) as image:
+        if settings.max_size:
+            # Lets the JPEG decoder downscale by up to 8x while reading
+            image.draft("RGB", (settings.max_size, settings.max_size))
+        image = ImageOps.exif_transpose(image)
+        if settings.max_size:
+            image.thumbnail((settings.max_size, settings.max_size), Image.LANCZOS)
+        if settings.image_format == "jpeg" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        partial = partial_path(dst)
+        try:
+            image.save(partial, format=settings.image_format.upper(), quality=settings.quality)
+            os.replace(partial, dst)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(partial)
+            raise
+    return "copied", os.path.getsize(dst), key
+
+
+def read_transform_cache(path):
+    import json
+
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_transform_cache(path, updates):
+    """Merge `updates` into the cache on disk and replace it atomically.
+
+    Shards share the destination, so the file is re-read right before the
+    write: entries written by other shards in the meantime are kept.
+    """
+    import json
+
+    cache = read_transform_cache(path)
+    cache.update(updates)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial = partial_path(path)
+    try:
+        with open(partial, "w", encoding="utf-8") as f:
+            json.dump(cache, f)
+        os.replace(partial, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(partial)
+        raise
+
+
+def transform_photos(photo_names, photo_folder, destination_folder, settings,
+                     result=None, progress=None, on_result=None, workers=None):
+    """Write resized/re-encoded images straight from the sources on a process pool.
+
+    Outputs are cached in the destination, keyed by source mtime, size and
+    settings, so a rerun only processes new or changed images.
+    """
+    try:
+        import PIL  # noqa: F401
+    except ImportError:
+        raise RuntimeError("Resizing or re-encoding images requires Pillow (pip install Pillow).")
+    from concurrent.futures import ProcessPoolExecutor
+
+    result = result or SelectionResult()
+    cache_path = os.path.join(destination_folder, JOURNAL_FOLDER, "transform-cache.json")
+    cache = read_transform_cache(cache_path)
+    updates = {}
+
+    names = list(photo_names)
+    keys = [name.replace(os.sep, '/') for name in names]
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            outcomes = executor.map(
+                transform_one,
+                [os.path.join(photo_folder, name) for name in names],
+                [os.path.join(destination_folder, settings.output_name(name)) for name in names],
+                [destination_folder] * len(names),
+                [settings] * len(names),
+                [cache.get(key) for key in keys],
+                chunksize=16
+            )
+            for done, (name, key, outcome) in enumerate(zip(names, keys, outcomes), 1):
+                status, nbytes, cache_key, seconds, error = outcome
+                if status == "copied":
+                    result.copied += 1
+                    result.bytes_copied += nbytes
+                elif status == "skipped":
+                    result.skipped += 1
+                elif status == "not_found":
+                    result.not_found.append(name)
+                else:
+                    result.failed.append((name, error))
+                if cache_key and cache.get(key) != cache_key:
+                    updates[key] = cache_key
+                if on_result:
+                    on_result(name, status, nbytes, seconds, error)
+                if progress and done % 256 == 0:
+                    progress(done, len(names))
+    finally:
+        if updates:
+            save_transform_cache(cache_path, updates)
+
+    result.workers = workers or os.cpu_count()
+    return result
+
+
+class RunReport:
+    """Machine-readable record of every image, written as the run goes.
+
+    Records go through a large write buffer, so memory stays flat and the
+    copy loop only pays for an occasional flush.
+    """
+
+    FIELDS = ("row", "name", "source", "status", "bytes", "seconds", "reason")
+
+    def __init__(self, path, buffer_size=1024 * 1024):
+        self.format = "csv" if path.lower().endswith(".csv") else "jsonl"
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "w", newline="", encoding="utf-8", buffering=buffer_size)
+        if self.format == "csv":
+            self._writer = csv.writer(self._file)
+            self._writer.writerow(self.FIELDS)
+        else:
+            import json
+            self._dumps = json.dumps
+
+    def write(self, row, name, source, status, nbytes=0, seconds=0.0, reason=None):
+        values = (row, name.replace(os.sep, "/"), source, status, nbytes, round(seconds, 6), reason)
+        if self.format == "csv":
+            self._writer.writerow(values)
+        else:
+            self._file.write(self._dumps(dict(zip(self.FIELDS, values))) + "\n")
+
+    def close(self):
+        self._file.close()
+
+
+def shard_of(photo_name, count):
+    """Stable shard number (0-based) of an image, identical on every OS and machine."""
+    import hashlib
+
+    key = photo_name.replace(os.sep, '/').encode('utf-8')
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'big') % count
+
+
+class ShardJournal:
+    """Append-only JSONL record of what one shard has done in the destination.
+
+    Rerunning a shard skips the images its journal already lists as copied,
+    as long as the copy is still in the destination.
+    """
+
+    FLUSH_EVERY = 256
+
+    def __init__(self, destination_folder, index, count):
+        import json
+
+        self._dumps = json.dumps
+        folder = os.path.join(destination_folder, JOURNAL_FOLDER)
+        os.makedirs(folder, exist_ok=True)
+        self.path = os.path.join(folder, f"shard-{index}-of-{count}.jsonl")
+        self.done = set()
+        if os.path.exists(self.path):
+            for record in read_journal(self.path):
+                if record["status"] == "copied":
+                    self.done.add(record["name"])
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._unflushed = 0
+
+    def write(self, name, status, nbytes, row=None):
+        record = {"name": name.replace(os.sep, '/'), "row": row, "status": status, "bytes": nbytes}
+        self._file.write(self._dumps(record) + "\n")
+        self._unflushed += 1
+        if self._unflushed >= self.FLUSH_EVERY:
+            self._file.flush()
+            self._unflushed = 0
+
+    def close(self):
+        self._file.close()
+
+
+def read_journal(path):
+    import json
+
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    pass  # a line cut short by an interrupted run
+
+
+def merge_shard_journals(destination_folder):
+    """Combine every shard journal of the destination into `report.json`.
+
+    The last record of each image wins, so reruns supersede earlier attempts.
+    Raises ValueError when shards are missing or were run with different N.
+    """
+    folder = os.path.join(destination_folder, JOURNAL_FOLDER)
+    paths = sorted(glob.glob(os.path.join(folder, "shard-*-of-*.jsonl")))
+    if not paths:
+        raise ValueError(f"No shard journals found in {folder}.")
+
+    shards = set()
+    counts = set()
+    for path in paths:
+        index, count = os.path.basename(path)[len("shard-"):-len(".jsonl")].split("-of-")
+        shards.add(int(index))
+        counts.add(int(count))
+    if len(counts) != 1:
+        raise ValueError(f"Shard journals were written with different shard counts: {sorted(counts)}")
+    count = counts.pop()
+    missing = sorted(set(range(1, count + 1)) - shards)
+    if missing:
+        raise ValueError(f"Missing journals for shards {missing} of {count}.")
+
+    records = {}
+    for path in paths:
+        for record in read_journal(path):
+            if record["status"] != "skipped":
+                records[record["name"]] = record
+
+    copied = sorted(name for name, record in records.items() if record["status"] == "copied")
+    not_found = sorted(name for name, record in records.items() if record["status"] == "not_found")
+    failed = sorted(name for name, record in records.items() if record["status"] == "failed")
+    report = {
+        "shards": count,
+        "copied": len(copied),
+        "not_found": not_found,
+        "failed": failed,
+        "bytes": sum(records[name]["bytes"] for name in copied),
+    }
+    import json
+
+    with open(os.path.join(folder, "report.json"), "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+IMAGE_EXTENSIONS = {
+    ".jpg", ".jpeg", ".png", ".gif", ".bmp", ".tif", ".tiff", ".webp", ".heic", ".heif",
+    ".cr2", ".cr3", ".nef", ".arw", ".dng", ".orf", ".raf", ".rw2",
+}
+# FAT and some SMB servers store mtimes with 2-second resolution
+MODIFY_WINDOW_NS = 2 * 10 ** 9
+
+
+def scan_destination(destination_folder, recursive=True):
+    """One scandir pass over the destination: {relative path: (size, mtime_ns)}."""
+    entries = {}
+    pending = [""]
+    while pending:
+        folder = pending.pop()
+        with os.scandir(os.path.join(destination_folder, folder)) as scan:
+            for entry in scan:
+                name = os.path.join(folder, entry.name) if folder else entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive and entry.name != JOURNAL_FOLDER:
+                        pending.append(name)
+                elif entry.is_file():
+                    stat = entry.stat()
+                    entries[name] = (stat.st_size, stat.st_mtime_ns)
+    return entries
+
+
+def file_digest(path):
+    import hashlib
+
+    digest = hashlib.blake2b()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.digest()
+
+
+class SyncPlan:
+    """Difference between the CSV selection and what the destination already holds."""
+
+    def __init__(self):
+        self.new = []
+        self.changed = []
+        self.unchanged = []
+        self.extra = []  # destination images that are not selected any more
+        self.prune = None
+
+    def summary(self):
+        lines = [
+            f"{len(self.new)} new, {len(self.changed)} changed, "
+            f"{len(self.unchanged)} unchanged images."
+        ]
+        if self.extra:
+            action = {"remove": "will be removed", "quarantine": "will be quarantined"}.get(
+                self.prune, "are left in place")
+            lines.append(f"{len(self.extra)} images not in the CSV {action}.")
+        return "\n".join(lines)
+
+
+def plan_sync(photo_names, photo_folder, destination_folder, use_hash=False,
+              prune=None, recursive=True, listed=None):
+    """Compare the selection with the destination without copying anything.
+
+    Images whose source cannot be read are left out of the plan; the copy
+    reports them as not found. Only destination images outside `listed`
+    (every image of the CSV, default `photo_names`) count as extra, so an
+    image the CSV lists is never pruned, whatever happened to its source.
+    """
+    plan = SyncPlan()
+    plan.prune = prune
+    existing = scan_destination(destination_folder, recursive)
+    for name in photo_names:
+        try:
+            stat = os.stat(os.path.join(photo_folder, name))
+        except OSError:
+            continue
+        current = existing.get(name)
+        if current is None:
+            plan.new.append(name)
+        elif current[0] != stat.st_size:
+            plan.changed.append(name)
+        elif use_hash:
+            same = file_digest(os.path.join(photo_folder, name)) == file_digest(
+                os.path.join(destination_folder, name))
+            (plan.unchanged if same else plan.changed).append(name)
+        elif abs(current[1] - stat.st_mtime_ns) > MODIFY_WINDOW_NS:
+            plan.changed.append(name)
+        else:
+            plan.unchanged.append(name)
+
+    selected = set(photo_names if listed is None else listed)
+    plan.extra = sorted(
+        name for name in existing
+        if name not in selected and os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+    )
+    return plan
+
+
+def prune_destination(destination_folder, names, mode):
+    """Remove the given destination images, or move them under the quarantine folder."""
+    quarantine = os.path.join(
+        destination_folder, JOURNAL_FOLDER, "quarantine", time.strftime("%Y%m%d-%H%M%S")
+    )
+    directories = DirectoryCache(destination_folder)
+    for name in names:
+        path = os.path.join(destination_folder, name)
+        if mode == "remove":
+            os.remove(path)
+        else:
+            target = os.path.join(quarantine, name)
+            directories.ensure(os.path.dirname(target))
+            os.replace(path, target)
+
+
+class PhotoIndex:
+    """Listing of a photo folder that is refreshed incrementally between runs.
+
+    A folder's mtime changes whenever an entry is added, removed or renamed in
+    it, so a warm refresh costs one stat per folder and only rescans the
+    folders that changed. Lookups are case-insensitive where the platform's
+    filesystems usually are.
+    """
+
+    CASE_INSENSITIVE = os.path.normcase("A") == "a" or sys.platform == "darwin"
+
+    def __init__(self, root, entries=None, recursive=True):
+        self.root = root
+        self.entries = entries or {}  # folder -> [mtime_ns, files, subfolders]
+        self.recursive = recursive
+        self.rescanned = 0
+        self.files = set()
+
+    def _key(self, name):
+        name = name.replace(os.sep, "/")
+        return name.casefold() if self.CASE_INSENSITIVE else name
+
+    def refresh(self):
+        entries = {}
+        files = set()
+        pending = [""]
+        while pending:
+            folder = pending.pop()
+            path = os.path.join(self.root, folder) if folder else self.root
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                continue
+            cached = self.entries.get(folder)
+            if cached and cached[0] == mtime:
+                _, names, subfolders = cached
+            else:
+                names, subfolders = [], []
+                with os.scandir(path) as scan:
+                    for entry in scan:
+                        (subfolders if entry.is_dir() else names).append(entry.name)
+                self.rescanned += 1
+            entries[folder] = [mtime, names, subfolders]
+            prefix = f"{folder}/" if folder else ""
+            files.update(self._key(prefix + name) for name in names)
+            if self.recursive:
+                pending.extend(prefix + subfolder for subfolder in subfolders)
+        self.entries = entries
+        self.files = files
+        return self
+
+    def __contains__(self, name):
+        return self._key(name) in self.files
+
+
+class WarmStart:
+    """Dialog answers and photo folder indexes kept in one JSON file between runs."""
+
+    def __init__(self, path):
+        import json
+
+        self.path = path
+        try:
+            with open(path, encoding="utf-8") as f:
+                self.data = json.load(f)
+        except (OSError, ValueError):
+            self.data = {}
+        self.selections = self.data.setdefault("selections", {})
+        self.indexes = self.data.setdefault("indexes", {})
+
+    def photo_index(self, photo_folder, recursive=True):
+        key = os.path.abspath(photo_folder)
+        index = PhotoIndex(photo_folder, self.indexes.get(key), recursive).refresh()
+        self.indexes[key] = index.entries
+        logger.info("Photo index: %d files, %d of %d folders rescanned",
+                    len(index.files), index.rescanned, len(index.entries))
+        return index
+
+    def save(self):
+        import json
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        partial = self.path + ".part"
+        with open(partial, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, separators=(",", ":"))
+        os.replace(partial, self.path)
+
+
+def location_key(location):
+    return location if "://" in location else os.path.abspath(location)
+
+
+class RunHistory:
+    """Local SQLite log of past runs, used to predict durations and spot slow runs.
+
+    Throughput is looked up for the same source/destination pair first, then
+    for the same pair of volumes, then across every recorded run.
+    """
+
+    SLOW_FACTOR = 0.5
+    MIN_RUNS_FOR_WARNING = 3
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        import sqlite3
+
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS runs (
+                id INTEGER PRIMARY KEY,
+                started_at REAL NOT NULL,
+                csv_file TEXT NOT NULL,
+                csv_bytes INTEGER NOT NULL,
+                source TEXT NOT NULL,
+                destination TEXT NOT NULL,
+                source_volume TEXT NOT NULL,
+                destination_volume TEXT NOT NULL,
+                names INTEGER NOT NULL,  -- images that went through the copy stage
+                copied INTEGER NOT NULL,
+                not_found INTEGER NOT NULL,
+                bytes INTEGER NOT NULL,
+                workers INTEGER,
+                copy_seconds REAL NOT NULL,
+                phases TEXT NOT NULL
+            )"""
+        )
+
+    def close(self):
+        self.connection.close()
+
+    @staticmethod
+    def volume_of(path):
+        if "://" in path:
+            return path.split("/")[2]  # the bucket
+        try:
+            return str(os.stat(path).st_dev)
+        except OSError:
+            return ""
+
+    def record(self, started_at, csv_file, source, destination, result):
+        import json
+
+        with self.connection:
+            self.connection.execute(
+                """INSERT INTO runs (started_at, csv_file, csv_bytes, source, destination,
+                    source_volume, destination_volume, names, copied, not_found, bytes,
+                    workers, copy_seconds, phases)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (
+                    started_at, os.path.abspath(csv_file), os.path.getsize(csv_file),
+                    location_key(source), location_key(destination),
+                    self.volume_of(source), self.volume_of(destination),
+                    result.copy_names, result.copied, len(result.not_found),
+                    result.bytes_copied, result.workers, result.phases.get("copy", 0.0),
+                    json.dumps(result.phases),
+                )
+            )
+
+    def _rates(self, source, destination):
+        """Past files/s for the closest match to this source/destination."""
+        queries = (
+            ("source = ? AND destination = ?",
+             (location_key(source), location_key(destination))),
+            ("source_volume = ? AND destination_volume = ?",
+             (self.volume_of(source), self.volume_of(destination))),
+            ("1", ()),
+        )
+        for where, params in queries:
+            rows = self.connection.execute(
+                f"SELECT names, copy_seconds FROM runs WHERE {where} AND copy_seconds > 0",
+                params
+            ).fetchall()
+            if rows:
+                return [names / seconds for names, seconds in rows]
+        return []
+
+    def estimate_seconds(self, source, destination, names):
+        rates = self._rates(source, destination)
+        if not rates:
+            return None
+        return names / median(rates)
+
+    def slow_run_warning(self, source, destination, result):
+        """Message when this run was much slower than usual for the same pair, else None.
+
+        Rates are compared in bytes/s when both this run and the past runs
+        moved data, and in images/s otherwise.
+        """
+        seconds = result.phases.get("copy", 0.0)
+        if not seconds or not result.copy_names:
+            return None
+        rows = self.connection.execute(
+            "SELECT names, bytes, copy_seconds FROM runs "
+            "WHERE source = ? AND destination = ? AND copy_seconds > 0",
+            (location_key(source), location_key(destination))
+        ).fetchall()
+        by_bytes = [(nbytes, copy_seconds) for _, nbytes, copy_seconds in rows if nbytes]
+        if result.bytes_copied and len(by_bytes) >= self.MIN_RUNS_FOR_WARNING:
+            usual = median(nbytes / copy_seconds for nbytes, copy_seconds in by_bytes) / 1e6
+            rate = result.bytes_copied / seconds / 1e6
+            unit = "MB/s"
+        elif len(rows) >= self.MIN_RUNS_FOR_WARNING:
+            usual = median(names / copy_seconds for names, _, copy_seconds in rows)
+            rate = result.copy_names / seconds
+            unit = "images/s"
+        else:
+            return None
+        if rate >= usual * self.SLOW_FACTOR:
+            return None
+        return (f"This run was {usual / rate:.1f}x slower than usual for this "
+                f"source and destination ({rate:.1f} vs {usual:.1f} {unit}).")
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}h {minutes:02d}m"
+    if minutes:
+        return f"{minutes}m {seconds:02d}s"
+    return f"{seconds}s"
+
+
+def run_selection(csv_file, photo_folder, destination_folder, file_name_column,
+                  options=None, profiler=None, confirm=None):
+    """Copy the images referenced by the CSV and return a SelectionResult.
+
+    With --sync, confirm(plan) is asked before the destination is changed;
+    returning False stops the run with nothing copied or pruned.
+    """
+    options = options or parse_args()
+    profiler = profiler or StageProfiler(options.profile)
+    result = SelectionResult()
+    started_at = time.time()
+
+    # Rows are deduplicated as they are read, so the raw references are never all in memory
+    with profiler.stage("csv_read"):
+        photo_names = read_photo_names(
+            csv_file, file_name_column, options.preserve_structure, options.separator
+        )
+    result.total_names = len(photo_names)
+    listed = set(photo_names)
+
+    settings = TransformSettings.from_options(options)
+    # A pinned --workers may exceed --max-workers; every worker needs a connection
+    pool_size = max(options.workers or 0, options.max_workers)
+    source = open_storage(photo_folder, pool_size)
+    destination = open_storage(destination_folder, pool_size)
+    if (settings or options.shard) and not (
+            isinstance(source, LocalStorage) and isinstance(destination, LocalStorage)):
+        raise ValueError("--max-size, --format and --shard need local source and destination folders.")
+    if options.sync and (settings or not (
+            isinstance(source, LocalStorage) and isinstance(destination, LocalStorage))):
+        raise ValueError(
+            "--sync needs local source and destination folders and cannot be combined with --max-size/--format."
+        )
+    if options.prune and (not options.sync or options.shard):
+        raise ValueError("--prune needs --sync and cannot be used with --shard.")
+
+    journal = None
+    skipped_names = {}
+    missing_names = {}  # confirmed missing in the resolve stage, never sent to the copy
+    present = set()  # known to exist in the source, copied without another stat
+    with profiler.stage("resolve"):
+        if options.preserve_structure or settings:
+            collisions = find_collisions(photo_names, settings.output_name if settings else None)
+            if collisions:
+                sample = "\n".join(" / ".join(group) for group in collisions[:10])
+                raise ValueError(
+                    f"{len(collisions)} destination collisions found, nothing was copied:\n{sample}"
+                )
+        if options.shard:
+            index, count = options.shard
+            photo_names = {
+                name: row for name, row in photo_names.items()
+                if shard_of(name, count) == index - 1
+            }
+            result.total_names = len(photo_names)
+            journal = ShardJournal(destination_folder, index, count)
+            for name in [name for name in photo_names if name.replace(os.sep, '/') in journal.done]:
+                output = settings.output_name(name) if settings else name
+                if os.path.exists(os.path.join(destination_folder, output)):
+                    skipped_names[name] = photo_names.pop(name)
+                    result.skipped += 1
+        if options.warm_start and isinstance(source, LocalStorage):
+            warm_start = WarmStart(options.warm_start)
+            photo_index = warm_start.photo_index(photo_folder, options.preserve_structure)
+            # Folder mtimes can be stale (coarse FAT timestamps, SMB/NFS attribute
+            # caching), so a miss is only a hint until the usual check confirms it.
+            # A stale hit is harmless: the copy then fails to open the source.
+            for name in list(photo_names):
+                if name in photo_index:
+                    present.add(name)
+                    continue
+                with contextlib.suppress(OSError):  # left for the copy to retry or fail
+                    if source.exists(name):
+                        present.add(name)
+                    else:
+                        missing_names[name] = photo_names.pop(name)
+            warm_start.save()
+        if options.sync:
+            plan = plan_sync(
+                photo_names, photo_folder, destination_folder, options.sync_hash,
+                options.prune, options.preserve_structure, listed
+            )
+            result.sync_plan = plan
+
+    if result.sync_plan:
+        logger.info("Sync plan: %s", result.sync_plan.summary())
+        if confirm and not confirm(result.sync_plan):
+            result.cancelled = True
+            return result
+        if result.sync_plan.prune and result.sync_plan.extra:
+            prune_destination(destination_folder, result.sync_plan.extra, result.sync_plan.prune)
+        for name in result.sync_plan.unchanged:
+            skipped_names[name] = photo_names.pop(name)
+            result.skipped += 1
+
+    report = RunReport(options.report) if options.report else None
+    history = RunHistory(options.history) if options.history else None
+    try:
+        if report:
+            for name, row in skipped_names.items():
+                report.write(row, name, source.location(name), "skipped")
+
+        def on_result(name, status, nbytes, seconds, reason):
+            row = photo_names[name] if name in photo_names else missing_names[name]
+            if journal:
+                journal.write(name, status, nbytes, row)
+            if report:
+                report.write(row, name, source.location(name), status, nbytes, seconds, reason)
+
+        if not (journal or report):
+            on_result = None
+        for name in missing_names:
+            result.not_found.append(name)
+            if on_result:
+                on_result(name, "not_found", 0, 0.0, None)
+
+        progress = None
+        if history:
+            estimate = history.estimate_seconds(photo_folder, destination_folder, len(photo_names))
+            if estimate is not None:
+                logger.info("Estimated copy time: %s", format_duration(estimate))
+            progress = eta_logger(estimate)
+
+        result.copy_names = len(photo_names)
+        with profiler.stage("copy"):
+            if settings:
+                transform_photos(
+                    photo_names, photo_folder, destination_folder, settings, result, progress,
+                    on_result, options.workers
+                )
+            else:
+                tuner = ConcurrencyTuner(maximum=options.max_workers, pinned=options.workers)
+                policy = RetryPolicy(retries=max(0, options.retries), timeout=options.timeout)
+                copy_photos(
+                    photo_names, source, destination, tuner, result, progress, on_result, policy,
+                    present=present
+                )
+        result.phases = dict(profiler.durations)
+
+        if history:
+            result.warning = history.slow_run_warning(photo_folder, destination_folder, result)
+            history.record(started_at, csv_file, photo_folder, destination_folder, result)
+    finally:
+        if journal:
+            journal.close()
+        if report:
+            report.close()
+        if history:
+            history.close()
+
+    return result
+
+
+def eta_logger(estimate, interval=5.0):
+    """Progress callback logging the remaining time at most every `interval` seconds.
+
+    The historical estimate is used until the current run has copied 5% of the
+    images, after which the run's own rate takes over.
+    """
+    started = time.perf_counter()
+    last_logged = [started]
+
+    def progress(done, total):
+        now = time.perf_counter()
+        if now - last_logged[0] < interval or done >= total:
+            return
+        last_logged[0] = now
+        remaining = (total - done) * (now - started) / done
+        if estimate is not None and done < total * 0.05:
+            remaining = max(estimate - (now - started), 0.0)
+        logger.info("Copied %d/%d, about %s left", done, total, format_duration(remaining))
+
+    return progress
+
+
+def show_not_found_window(root, not_found):
+    import tkinter as tk
+
+    not_found_window = tk.Toplevel(root)
+    not_found_window.title("Images Not Found")
+    not_found_window.geometry("600x400")
+
+    max_lines = min(len(not_found), 40)  # fino a 40 righe visibili
+    line_height = 20
+    height = max_lines * line_height + 100
+    not_found_window.geometry(f"800x{height}")
+    not_found_window.minsize(500, 300)
+
+    # Intestazione
+    label = tk.Label(not_found_window, text="The following images were not found:", font=("Arial", 12))
+    label.pack(pady=(10, 0))
+
+    # Contenitore principale per testo + scrollbar
+    frame = tk.Frame(not_found_window)
+    frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+
+    # Scrollbar verticale
+    scrollbar = tk.Scrollbar(frame)
+    scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+    # Testo selezionabile
+    text_widget = tk.Text(frame, wrap=tk.NONE, yscrollcommand=scrollbar.set)
+    text_widget.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+    scrollbar.config(command=text_widget.yview)
+
+    # Inserisci testo
+    for image in not_found:
+        text_widget.insert(tk.END, image + "\n")
+    text_widget.config(state=tk.DISABLED)
+
+    # Pulsante "Close"
+    close_button = tk.Button(not_found_window, text="Close", command=not_found_window.destroy)
+    close_button.pack(pady=(0, 10))
+
+    # Modalità modale
+    not_found_window.transient(root)
+    not_found_window.grab_set()
+    root.deiconify()
+    root.wait_window(not_found_window)
+
+
+def main(argv=None):
+    options = parse_args(argv)
+    if options.merge_shards:
+        report = merge_shard_journals(options.merge_shards)
+        print(f"Merged {report['shards']} shards: copied {report['copied']} images, "
+              f"not found: {len(report['not_found'])}")
+        return
+
+    import tkinter as tk
+    from tkinter import messagebox, simpledialog
+
+    profiler = StageProfiler(options.profile)
+
     root = tk.Tk()
     root.withdraw()  # Hides the main window
 
-    csv_file = select_csv()
+    warm_start = WarmStart(options.warm_start) if options.warm_start else None
+    last = warm_start.selections if warm_start else {}
+
+    csv_file = select_csv(os.path.dirname(last.get("csv_file", "")) or None)
     if not csv_file:
         messagebox.showerror("Error", "No CSV file selected.")
         return
 
-    photo_folder = select_folder("Select the folder of original photos")
+    photo_folder = options.source or select_folder(
+        "Select the folder of original photos", last.get("photo_folder")
+    )
     if not photo_folder:
         messagebox.showerror("Error", "No photo folder selected.")
         return
 
-    destination_folder = select_folder("Select the destination folder")
+    destination_folder = options.destination or select_folder(
+        "Select the destination folder", last.get("destination_folder")
+    )
     if not destination_folder:
         messagebox.showerror("Error", "No destination folder selected.")
         return
 
+    column_prompt = {"initialvalue": last["file_name_column"]} if last.get("file_name_column") else {}
     file_name_column = simpledialog.askstring(
         "Input",
-        "Enter the name of the column containing the image in the CSV:"
+        "Enter the name of the column containing the image in the CSV\n"
+        "(separate several columns with commas, or use a pattern such as image*):",
+        **column_prompt
     )
     if not file_name_column:
         messagebox.showerror("Error", "No column name provided.")
         return
 
-    try:
-        with open(csv_file, newline='', encoding='utf-8') as f:
-            
-            first_line = f.readline()
-            f.seek(0)  # torna all'inizio del file
-            delimiter = detect_delimiter(first_line)
-            reader = csv.DictReader(f, delimiter=delimiter)
-            
-            # Case-insensitive header matching
-            header_map = {col.lower(): col for col in reader.fieldnames}
-            requested_col = file_name_column.strip().lower()
-            if requested_col not in header_map:
-                messagebox.showerror("Error", f"Column '{file_name_column}' not found in CSV.")
-                return
-            actual_column = header_map[requested_col]
-
-            photo_names = {
-                os.path.basename(row[actual_column])
-                for row in reader
-                if row.get(actual_column)
-            }
-
-        not_found = []
-        copied = 0
-
-        for photo_name in photo_names:
-            src = os.path.join(photo_folder, photo_name)
-            dst = os.path.join(destination_folder, photo_name)
-            if os.path.exists(src):
-                shutil.copy2(src, dst)
-                copied += 1
-            else:
-                not_found.append(photo_name)
+    if warm_start:
+        warm_start.selections.update(
+            csv_file=csv_file, photo_folder=photo_folder,
+            destination_folder=destination_folder, file_name_column=file_name_column
+        )
+        warm_start.save()
 
-        messagebox.showinfo(
-            "Completed",
-            f"Copied {copied} images.\nNot found: {len(not_found)}"
+    try:
+        result = run_selection(
+            csv_file, photo_folder, destination_folder, file_name_column, options, profiler,
+            confirm=lambda plan: messagebox.askokcancel("Sync", f"{plan.summary()}\n\nApply?")
         )
+        if result.cancelled:
+            root.destroy()
+            return
+
+        with profiler.stage("report"):
+            message = f"Copied {result.copied} images.\nNot found: {len(result.not_found)}"
+            if result.failed:
+                message += f"\nFailed: {len(result.failed)}"
+            if result.sync_plan:
+                message += f"\nUnchanged: {len(result.sync_plan.unchanged)}"
+                if result.sync_plan.prune:
+                    message += f"\nPruned: {len(result.sync_plan.extra)}"
+            if result.warning:
+                message += f"\n\n{result.warning}"
+            messagebox.showinfo("Completed", message)
 
-        if not_found:
-            not_found_window = tk.Toplevel(root)
-            not_found_window.title("Images Not Found")
-            not_found_window.geometry("600x400")
-            
-            max_lines = min(len(not_found), 40)  # fino a 40 righe visibili
-            line_height = 20
-            height = max_lines * line_height + 100
-            not_found_window.geometry(f"800x{height}")
-            not_found_window.minsize(500, 300)
-
-            # Intestazione
-            label = tk.Label(not_found_window, text="The following images were not found:", font=("Arial", 12))
-            label.pack(pady=(10, 0))
-
-            # Contenitore principale per testo + scrollbar
-            frame = tk.Frame(not_found_window)
-            frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
-
-            # Scrollbar verticale
-            scrollbar = tk.Scrollbar(frame)
-            scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-
-            # Testo selezionabile
-            text_widget = tk.Text(frame, wrap=tk.NONE, yscrollcommand=scrollbar.set)
-            text_widget.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-
-            scrollbar.config(command=text_widget.yview)
-
-            # Inserisci testo
-            for image in not_found:
-                text_widget.insert(tk.END, image + "\n")
-            text_widget.config(state=tk.DISABLED)
-
-            # Pulsante "Close"
-            close_button = tk.Button(not_found_window, text="Close", command=not_found_window.destroy)
-            close_button.pack(pady=(0, 10))
-
-            # Modalità modale
-            not_found_window.transient(root)
-            not_found_window.grab_set()
-            root.deiconify()
-            root.wait_window(not_found_window)
+            if result.not_found:
+                show_not_found_window(root, result.not_found)
 
         root.destroy()
 
@@ -147,4 +1950,6 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    import logging
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    main(sys.argv[1:])
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Startup benchmark for ImageSelector.
+
+Measures the import time of the module in fresh interpreters against an
+eager baseline: the same import with every module it defers (tkinter,
+argparse, logging, json, hashlib, concurrent.futures) loaded up front. With --baseline REF the module
+as of git revision REF is timed as well. Then runs run_selection on a
+generated library without --warm-start and with it, on a cold and a warm
+cache, and reports the resolve and copy stage times and the stat calls
+made on the photo folder.
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+# Add current directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import ImageSelector
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFERRED_MODULES = "tkinter, tkinter.filedialog, argparse, logging, json, hashlib, concurrent.futures"
+
+
+def measure_import(folder=HERE, preload=None, runs=5):
+    """Median wall time of `import ImageSelector` from `folder` in a fresh interpreter.
+
+    Modules in `preload` are imported inside the timed region first. A first,
+    untimed run compiles the bytecode cache so every sample starts warm.
+    """
+    imports = f"import {preload}; import ImageSelector" if preload else "import ImageSelector"
+    script = (
+        f"import sys, time; sys.path.insert(0, {folder!r}); started = time.perf_counter(); "
+        f"{imports}; print(time.perf_counter() - started)"
+    )
+    env = dict(os.environ)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    timings = []
+    for run in range(runs + 1):
+        output = subprocess.check_output([sys.executable, "-c", script], cwd=folder, env=env)
+        if run:
+            timings.append(float(output))
+    return ImageSelector.median(timings)
+
+
+def checkout_module(ref, folder):
+    """Write ImageSelector.py as of git revision `ref` into `folder`."""
+    source = subprocess.check_output(["git", "show", f"{ref}:ImageSelector.py"], cwd=HERE)
+    with open(os.path.join(folder, "ImageSelector.py"), "wb") as f:
+        f.write(source)
+    return folder
+
+
+def build_library(root, folders=200, files_per_folder=100):
+    photo_folder = os.path.join(root, "photos")
+    names = []
+    for i in range(folders):
+        folder = os.path.join(photo_folder, f"folder{i:04d}")
+        os.makedirs(folder)
+        for j in range(files_per_folder):
+            name = f"IMG_{j:05d}.jpg"
+            open(os.path.join(folder, name), "wb").close()
+            names.append(f"folder{i:04d}/{name}")
+
+    csv_file = os.path.join(root, "selection.csv")
+    with open(csv_file, "w", encoding="utf-8") as f:
+        f.write("image\n")
+        for name in names[::2]:
+            f.write(name + "\n")
+        f.write("missing/IMG_99999.jpg\n")
+    return csv_file, photo_folder
+
+
+def measure_run(csv_file, photo_folder, destination_folder, warm_start_path=None):
+    """Resolve and copy stage times of run_selection, and the stat calls it made on the source"""
+    arguments = ["--preserve-structure"]
+    if warm_start_path:
+        arguments += ["--warm-start", warm_start_path]
+    os.makedirs(destination_folder)
+    stats = 0
+    real_stat = os.stat
+
+    def counting_stat(path, *args, **kwargs):
+        nonlocal stats
+        if os.fspath(path).startswith(photo_folder):
+            stats += 1
+        return real_stat(path, *args, **kwargs)
+
+    os.stat = counting_stat
+    try:
+        result = ImageSelector.run_selection(
+            csv_file, photo_folder, destination_folder, "image",
+            ImageSelector.parse_args(arguments)
+        )
+    finally:
+        os.stat = real_stat
+    return result.phases["resolve"], result.phases["copy"], stats, result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--baseline", metavar="REF",
+                        help="also time the import of ImageSelector.py as of git revision REF")
+    args = parser.parse_args()
+
+    print("ImageSelector Startup Benchmark")
+    print("=" * 50)
+    temp_dir = tempfile.mkdtemp()
+    try:
+        lazy = measure_import()
+        eager = measure_import(preload=DEFERRED_MODULES)
+        print(f"Import, current:         {lazy * 1000:6.1f} ms (median of 5)")
+        print(f"Import, eager baseline:  {eager * 1000:6.1f} ms "
+              f"(lazy imports save {(eager - lazy) * 1000:.1f} ms)")
+        if args.baseline:
+            baseline = measure_import(checkout_module(args.baseline, temp_dir))
+            print(f"Import, {args.baseline}: {baseline * 1000:6.1f} ms "
+                  f"(current saves {(baseline - lazy) * 1000:.1f} ms)")
+
+        csv_file, photo_folder = build_library(temp_dir)
+        warm_start_path = os.path.join(temp_dir, "warm-start.json")
+        runs = [("Without --warm-start", None), ("Warm start, cold cache", warm_start_path),
+                ("Warm start, warm cache", warm_start_path)]
+        for number, (label, path) in enumerate(runs):
+            destination_folder = os.path.join(temp_dir, f"destination{number}")
+            resolve, copy, stats, result = measure_run(csv_file, photo_folder, destination_folder, path)
+            print(f"{label + ':':24} resolve {resolve * 1000:6.1f} ms, copy {copy * 1000:7.1f} ms, "
+                  f"{stats} source stats ({result.copied} copied, {len(result.not_found)} missing)")
+    finally:
+        shutil.rmtree(temp_dir)
@@ -1,8 +1,17 @@
 import unittest
+import argparse
+import codecs
+import errno
+import hashlib
+import io
+import json
 import os
 import shutil
+import subprocess
 import sys
 import tempfile
+import threading
+import time
 import csv
 from unittest.mock import patch, MagicMock
 
@@ -215,5 +224,1215 @@ class TestImageSelector(unittest.TestCase):
         self.assertEqual(args[0], "Error")
 
 
+class TestPreserveStructure(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.photo_folder = os.path.join(self.temp_dir, "photos")
+        self.destination_folder = os.path.join(self.temp_dir, "destination")
+        os.makedirs(self.destination_folder)
+        for folder in ("a", "b"):
+            os.makedirs(os.path.join(self.photo_folder, folder))
+            with open(os.path.join(self.photo_folder, folder, "IMG_0001.jpg"), "w") as f:
+                f.write(f"image from {folder}")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def write_csv(self, *paths):
+        csv_file = os.path.join(self.temp_dir, "paths.csv")
+        with open(csv_file, "w", newline='', encoding='utf-8') as f:
+            writer = csv.writer(f, delimiter=';')
+            writer.writerow(['image'])
+            for path in paths:
+                writer.writerow([path])
+        return csv_file
+
+    def test_normalize_reference(self):
+        """Test that references are made relative and cannot escape the folder"""
+        self.assertEqual(ImageSelector.normalize_reference("a/IMG_0001.jpg"), "IMG_0001.jpg")
+        self.assertEqual(
+            ImageSelector.normalize_reference("C:\\a\\b\\x.jpg", preserve_structure=True),
+            os.path.join("a", "b", "x.jpg")
+        )
+        self.assertEqual(
+            ImageSelector.normalize_reference("/a/./b/../x.jpg", preserve_structure=True),
+            os.path.join("a", "x.jpg")
+        )
+        self.assertIsNone(ImageSelector.normalize_reference("../x.jpg", preserve_structure=True))
+        self.assertIsNone(ImageSelector.normalize_reference("  ", preserve_structure=True))
+
+    def test_same_name_in_different_folders_is_kept(self):
+        """Test that a/IMG_0001.jpg and b/IMG_0001.jpg are both copied"""
+        csv_file = self.write_csv("a/IMG_0001.jpg", "b\\IMG_0001.jpg", "c/missing.jpg")
+        options = ImageSelector.parse_args(["--preserve-structure"])
+
+        result = ImageSelector.run_selection(
+            csv_file, self.photo_folder, self.destination_folder, "image", options
+        )
+
+        self.assertEqual(result.copied, 2)
+        self.assertEqual(result.not_found, [os.path.join("c", "missing.jpg")])
+        for folder in ("a", "b"):
+            with open(os.path.join(self.destination_folder, folder, "IMG_0001.jpg")) as f:
+                self.assertEqual(f.read(), f"image from {folder}")
+
+    def test_collisions_abort_before_copying(self):
+        """Test that paths differing only by case are rejected up front"""
+        csv_file = self.write_csv("a/IMG_0001.jpg", "A/img_0001.JPG")
+        options = ImageSelector.parse_args(["--preserve-structure"])
+
+        with self.assertRaises(ValueError):
+            ImageSelector.run_selection(
+                csv_file, self.photo_folder, self.destination_folder, "image", options
+            )
+        self.assertEqual(os.listdir(self.destination_folder), [])
+
+    def test_directory_cache_creates_each_folder_once(self):
+        """Test that the directory cache issues one mkdir per new folder"""
+        cache = ImageSelector.DirectoryCache(self.destination_folder)
+        for i in range(50):
+            cache.ensure(os.path.join(self.destination_folder, "x", f"d{i % 5}"))
+
+        self.assertEqual(cache.mkdir_calls, 6)
+        self.assertTrue(os.path.isdir(os.path.join(self.destination_folder, "x", "d4")))
+
+
+class TestConcurrencyTuner(unittest.TestCase):
+
+    def test_grows_while_throughput_improves(self):
+        """Test that concurrency doubles while throughput keeps rising"""
+        tuner = ImageSelector.ConcurrencyTuner(initial=2, maximum=16)
+        tuner.record(10, 10_000_000, 1.0, [0.1] * 10)
+        self.assertEqual(tuner.workers, 4)
+        tuner.record(10, 20_000_000, 1.0, [0.1] * 10)
+        self.assertEqual(tuner.workers, 8)
+        tuner.record(10, 20_000_000, 1.0, [0.1] * 10)
+        self.assertTrue(tuner.settled)
+        self.assertEqual(tuner.workers, 4)
+
+    def test_backs_off_on_latency_spike(self):
+        """Test that a latency spike halves the worker count and settles"""
+        tuner = ImageSelector.ConcurrencyTuner(initial=4, maximum=32)
+        tuner.record(10, 10_000_000, 1.0, [0.1] * 10)
+        tuner.record(10, 30_000_000, 1.0, [0.5] * 10)
+        self.assertTrue(tuner.settled)
+        self.assertEqual(tuner.workers, 4)
+
+    def test_pinned_workers_are_not_tuned(self):
+        """Test that --workers disables tuning"""
+        tuner = ImageSelector.ConcurrencyTuner(pinned=3)
+        tuner.record(10, 10_000_000, 1.0, [0.1] * 10)
+        self.assertEqual(tuner.workers, 3)
+
+    def test_worker_counts_must_be_positive(self):
+        """Test that --workers and --max-workers reject values below 1"""
+        for args in (["--workers", "0"], ["--workers", "-2"], ["--max-workers", "0"]):
+            with self.subTest(args=args), patch('sys.stderr'):
+                with self.assertRaises(SystemExit):
+                    ImageSelector.parse_args(args)
+        with self.assertRaises(ValueError):
+            ImageSelector.ConcurrencyTuner(pinned=0)
+
+    def test_parallel_copy(self):
+        """Test that the batched parallel copy reports every file"""
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        photo_folder = os.path.join(temp_dir, "photos")
+        destination_folder = os.path.join(temp_dir, "destination")
+        os.makedirs(photo_folder)
+        os.makedirs(destination_folder)
+        names = [f"photo{i}.jpg" for i in range(40)]
+        for name in names:
+            with open(os.path.join(photo_folder, name), "w") as f:
+                f.write(name)
+
+        result = ImageSelector.copy_photos(
+            names + ["missing.jpg"], photo_folder, destination_folder,
+            ImageSelector.ConcurrencyTuner(initial=1, maximum=4)
+        )
+
+        self.assertEqual(result.copied, 40)
+        self.assertEqual(result.bytes_copied, sum(len(name) for name in names))
+        self.assertEqual(result.not_found, ["missing.jpg"])
+        self.assertEqual(sorted(os.listdir(destination_folder)), sorted(names))
+
+
+class TestRunHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.history_path = os.path.join(self.temp_dir, "history", "runs.sqlite")
+        self.csv_file = os.path.join(self.temp_dir, "test.csv")
+        with open(self.csv_file, "w", encoding='utf-8') as f:
+            f.write("image\nphoto.jpg\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def make_result(self, names, copy_seconds, nbytes=0):
+        result = ImageSelector.SelectionResult()
+        result.total_names = names
+        result.copy_names = names
+        result.copied = names
+        result.bytes_copied = nbytes
+        result.phases = {"csv_read": 0.1, "copy": copy_seconds}
+        return result
+
+    def test_estimate_and_slow_run_warning(self):
+        """Test that recorded runs drive the ETA and flag slow runs"""
+        history = ImageSelector.RunHistory(self.history_path)
+        self.addCleanup(history.close)
+        self.assertIsNone(history.estimate_seconds("src", "dst", 100))
+
+        for _ in range(3):
+            history.record(0, self.csv_file, "src", "dst", self.make_result(100, 10.0))
+
+        self.assertAlmostEqual(history.estimate_seconds("src", "dst", 50), 5.0)
+        self.assertIsNone(history.slow_run_warning("src", "dst", self.make_result(100, 12.0)))
+        warning = history.slow_run_warning("src", "dst", self.make_result(100, 40.0))
+        self.assertIn("4.0x slower", warning)
+
+    def test_slow_run_compares_bytes_when_known(self):
+        """Test that byte throughput is preferred over image counts"""
+        history = ImageSelector.RunHistory(self.history_path)
+        self.addCleanup(history.close)
+        for _ in range(3):
+            history.record(0, self.csv_file, "src", "dst", self.make_result(100, 10.0, 10 ** 8))
+
+        # Same images/s, but a fifth of the usual MB/s
+        warning = history.slow_run_warning("src", "dst", self.make_result(100, 10.0, 2 * 10 ** 7))
+        self.assertIn("MB/s", warning)
+
+    def test_run_selection_records_history(self):
+        """Test that run_selection writes one history row per run"""
+        photo_folder = os.path.join(self.temp_dir, "photos")
+        os.makedirs(photo_folder)
+        with open(os.path.join(photo_folder, "photo.jpg"), "w") as f:
+            f.write("data")
+        options = ImageSelector.parse_args(["--history", self.history_path])
+
+        ImageSelector.run_selection(self.csv_file, photo_folder, self.temp_dir, "image", options)
+        ImageSelector.run_selection(self.csv_file, photo_folder, self.temp_dir, "image", options)
+
+        history = ImageSelector.RunHistory(self.history_path)
+        self.addCleanup(history.close)
+        rows = history.connection.execute("SELECT names, copied, bytes FROM runs").fetchall()
+        self.assertEqual(rows, [(1, 1, 4), (1, 1, 4)])
+
+    def test_only_copy_stage_images_are_recorded(self):
+        """Test that images skipped before the copy do not inflate the rate"""
+        photo_folder = os.path.join(self.temp_dir, "photos")
+        destination_folder = os.path.join(self.temp_dir, "destination")
+        os.makedirs(photo_folder)
+        os.makedirs(destination_folder)
+        with open(self.csv_file, "w", encoding='utf-8') as f:
+            f.write("image\n" + "\n".join(f"photo{i}.jpg" for i in range(10)) + "\n")
+        for i in range(10):
+            with open(os.path.join(photo_folder, f"photo{i}.jpg"), "w") as f:
+                f.write("data")
+        ImageSelector.run_selection(self.csv_file, photo_folder, destination_folder, "image")
+        os.remove(os.path.join(destination_folder, "photo0.jpg"))
+        options = ImageSelector.parse_args(["--sync", "--history", self.history_path])
+
+        ImageSelector.run_selection(self.csv_file, photo_folder, destination_folder, "image", options)
+
+        history = ImageSelector.RunHistory(self.history_path)
+        self.addCleanup(history.close)
+        rows = history.connection.execute("SELECT names, copied FROM runs").fetchall()
+        self.assertEqual(rows, [(1, 1)])
+
+
+class TestDetectEncoding(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def write(self, data):
+        path = os.path.join(self.temp_dir, "export.csv")
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def test_detected_encodings(self):
+        """Test BOM sniffing, BOM-less UTF-16 and the cp1252 fallback"""
+        text = "Image;Città\r\nfoto1.jpg;Milano\r\n"
+        cases = [
+            (text.encode('utf-8'), 'utf-8'),
+            (codecs.BOM_UTF8 + text.encode('utf-8'), 'utf-8-sig'),
+            (text.encode('utf-16'), 'utf-16'),
+            (text.encode('utf-16-le'), 'utf-16-le'),
+            (text.encode('utf-16-be'), 'utf-16-be'),
+            (text.encode('utf-32'), 'utf-32'),
+            (text.encode('cp1252'), 'cp1252'),
+        ]
+        for data, expected in cases:
+            with self.subTest(expected=expected):
+                self.assertEqual(ImageSelector.detect_encoding(self.write(data)), expected)
+
+    def test_multibyte_character_cut_by_sample(self):
+        """Test that a UTF-8 character split at the sample boundary is still UTF-8"""
+        path = self.write(("a" * 9 + "è" * 10).encode('utf-8'))
+        self.assertEqual(ImageSelector.detect_encoding(path, sample_size=10), 'utf-8')
+
+    def test_bom_does_not_break_header_lookup(self):
+        """Test that a UTF-8 BOM does not hide the first column"""
+        path = self.write(codecs.BOM_UTF8 + "Image;Description\nphoto1.jpg;x\n".encode('utf-8'))
+        self.assertEqual(set(ImageSelector.read_photo_names(path, "image")), {"photo1.jpg"})
+
+    def test_utf16_csv_is_read(self):
+        """Test that a UTF-16 Windows export is parsed"""
+        path = self.write("image\tnote\r\nfoto_è.jpg\tx\r\n".encode('utf-16'))
+        self.assertEqual(set(ImageSelector.read_photo_names(path, "IMAGE")), {"foto_è.jpg"})
+
+
+class TestStageProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_disabled_profiler_only_times(self):
+        """Test that without a directory stages are timed but nothing is written"""
+        profiler = ImageSelector.StageProfiler()
+        with profiler.stage("csv_read"):
+            pass
+        self.assertIn("csv_read", profiler.durations)
+        self.assertEqual(os.listdir(self.temp_dir), [])
+
+    def test_run_selection_writes_stage_profiles(self):
+        """Test that --profile writes a .prof and an allocation summary per stage"""
+        csv_file = os.path.join(self.temp_dir, "test.csv")
+        with open(csv_file, "w", encoding='utf-8') as f:
+            f.write("image\nphoto.jpg\n")
+        diagnostics = os.path.join(self.temp_dir, "diagnostics")
+        options = ImageSelector.parse_args(["--profile", diagnostics])
+
+        result = ImageSelector.run_selection(
+            csv_file, self.temp_dir, self.temp_dir, "image", options
+        )
+
+        stages = ["csv_read", "resolve", "copy"]
+        self.assertEqual(list(result.phases), stages)
+        expected = {f"{stage}.prof" for stage in stages}
+        expected |= {f"{stage}-allocations.txt" for stage in stages}
+        self.assertEqual(set(os.listdir(diagnostics)), expected)
+        with open(os.path.join(diagnostics, "csv_read-allocations.txt")) as f:
+            self.assertIn("Peak traced memory", f.read())
+
+
+class TestShardedRuns(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.photo_folder = os.path.join(self.temp_dir, "photos")
+        self.destination_folder = os.path.join(self.temp_dir, "destination")
+        os.makedirs(self.photo_folder)
+        os.makedirs(self.destination_folder)
+        self.names = [f"photo{i}.jpg" for i in range(30)]
+        for name in self.names:
+            with open(os.path.join(self.photo_folder, name), "w") as f:
+                f.write(name)
+        self.csv_file = os.path.join(self.temp_dir, "test.csv")
+        with open(self.csv_file, "w", encoding='utf-8') as f:
+            f.write("image\n" + "\n".join(self.names + ["missing.jpg"]) + "\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_parse_shard(self):
+        """Test the i/N shard syntax"""
+        self.assertEqual(ImageSelector.parse_shard("2/4"), (2, 4))
+        for value in ("0/4", "5/4", "1", "a/b"):
+            with self.assertRaises(argparse.ArgumentTypeError):
+                ImageSelector.parse_shard(value)
+
+    def test_shards_are_disjoint_and_complete(self):
+        """Test that every image lands in exactly one shard"""
+        shards = [ImageSelector.shard_of(name, 3) for name in self.names]
+        self.assertTrue(all(0 <= shard < 3 for shard in shards))
+        self.assertEqual(len(set(shards)), 3)
+
+    def test_shards_in_separate_processes_and_merge(self):
+        """Test that three processes split the CSV and the merge sees everything"""
+        script = (
+            "import sys; sys.path.insert(0, sys.argv[1]); import ImageSelector; "
+            "options = ImageSelector.parse_args(['--shard', sys.argv[2]]); "
+            "ImageSelector.run_selection(sys.argv[3], sys.argv[4], sys.argv[5], 'image', options)"
+        )
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        processes = [
+            subprocess.Popen([sys.executable, "-c", script, root, f"{i}/3",
+                              self.csv_file, self.photo_folder, self.destination_folder])
+            for i in (1, 2, 3)
+        ]
+        for process in processes:
+            self.assertEqual(process.wait(timeout=60), 0)
+
+        report = ImageSelector.merge_shard_journals(self.destination_folder)
+
+        self.assertEqual(report["copied"], 30)
+        self.assertEqual(report["not_found"], ["missing.jpg"])
+        for name in self.names:
+            self.assertTrue(os.path.exists(os.path.join(self.destination_folder, name)))
+
+    def test_shard_rerun_skips_copied_images(self):
+        """Test that rerunning a shard only copies what is still missing"""
+        options = ImageSelector.parse_args(["--shard", "1/2"])
+        first = ImageSelector.run_selection(
+            self.csv_file, self.photo_folder, self.destination_folder, "image", options
+        )
+        second = ImageSelector.run_selection(
+            self.csv_file, self.photo_folder, self.destination_folder, "image", options
+        )
+
+        self.assertGreater(first.copied, 0)
+        self.assertEqual(second.copied, 0)
+        self.assertEqual(second.skipped, first.copied)
+
+    def test_merge_requires_every_shard(self):
+        """Test that merging fails when a shard journal is missing"""
+        options = ImageSelector.parse_args(["--shard", "1/2"])
+        ImageSelector.run_selection(
+            self.csv_file, self.photo_folder, self.destination_folder, "image", options
+        )
+        with self.assertRaises(ValueError):
+            ImageSelector.merge_shard_journals(self.destination_folder)
+
+
+class TestFlakySources(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.photo_folder = os.path.join(self.temp_dir, "photos")
+        self.destination_folder = os.path.join(self.temp_dir, "destination")
+        os.makedirs(self.photo_folder)
+        os.makedirs(self.destination_folder)
+        self.names = [f"photo{i}.jpg" for i in range(4)]
+        for name in self.names:
+            with open(os.path.join(self.photo_folder, name), "w") as f:
+                f.write(name)
+        self.real_copy_file = ImageSelector.copy_file
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def copy(self, names, policy, breaker=None):
+        return ImageSelector.copy_photos(
+            names, self.photo_folder, self.destination_folder,
+            ImageSelector.ConcurrencyTuner(pinned=2), policy=policy, breaker=breaker
+        )
+
+    def test_transient_errors_are_retried(self):
+        """Test that an I/O error is retried until the copy succeeds"""
+        failures = [OSError(errno.EIO, "I/O error"), OSError(errno.ESTALE, "Stale handle")]
+
+        def flaky_copy(src, dst, heartbeat=None):
+            if src.endswith("photo0.jpg") and failures:
+                raise failures.pop()
+            return self.real_copy_file(src, dst, heartbeat)
+
+        with patch('ImageSelector.copy_file', side_effect=flaky_copy):
+            result = self.copy(self.names, ImageSelector.RetryPolicy(retries=3, backoff=0.001))
+
+        self.assertEqual(result.copied, 4)
+        self.assertEqual(result.failed, [])
+
+    def test_permanent_errors_fail_without_retry(self):
+        """Test that a permission error goes to the failed list, not to not_found"""
+        calls = []
+
+        def denied_copy(src, dst, heartbeat=None):
+            calls.append(src)
+            raise PermissionError(errno.EACCES, "Permission denied")
+
+        with patch('ImageSelector.copy_file', side_effect=denied_copy):
+            result = self.copy(self.names[:1] + ["missing.jpg"],
+                               ImageSelector.RetryPolicy(retries=3, backoff=0.001))
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([name for name, _ in result.failed], ["photo0.jpg"])
+        self.assertEqual(result.not_found, ["missing.jpg"])
+
+    def test_timeout_must_be_positive(self):
+        """Test that --timeout rejects values that would time out every attempt"""
+        for value in ("0", "-5", "nan"):
+            with self.subTest(value=value), patch('sys.stderr'):
+                with self.assertRaises(SystemExit):
+                    ImageSelector.parse_args(["--timeout", value])
+        self.assertEqual(ImageSelector.parse_args(["--timeout", "2.5"]).timeout, 2.5)
+
+    def test_hung_file_times_out(self):
+        """Test that a hung copy is abandoned and the other files still copy"""
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def hanging_copy(src, dst, heartbeat=None):
+            if src.endswith("photo0.jpg"):
+                release.wait(10)
+            return self.real_copy_file(src, dst, heartbeat)
+
+        started = time.monotonic()
+        with patch('ImageSelector.copy_file', side_effect=hanging_copy):
+            result = self.copy(self.names, ImageSelector.RetryPolicy(retries=0, timeout=0.2))
+
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual(result.copied, 3)
+        self.assertEqual(len(result.failed), 1)
+        self.assertIn("no progress", result.failed[0][1])
+
+        # Once released, the abandoned attempt stops without publishing its copy
+        release.set()
+        time.sleep(0.2)
+        self.assertEqual(sorted(os.listdir(self.destination_folder)), self.names[1:])
+
+    def test_hung_file_does_not_stall_later_files(self):
+        """Test that the files after the first batch start while a hung file times out"""
+        names = [f"p{i}.jpg" for i in range(40)]
+        for name in names:
+            with open(os.path.join(self.photo_folder, name), "w") as f:
+                f.write(name)
+        release = threading.Event()
+        self.addCleanup(release.set)
+        started = {}
+        begin = time.monotonic()
+
+        def hanging_copy(src, dst, heartbeat=None):
+            name = os.path.basename(src)
+            started.setdefault(name, time.monotonic() - begin)
+            if name == "p0.jpg":
+                release.wait(10)
+            return self.real_copy_file(src, dst, heartbeat)
+
+        with patch('ImageSelector.copy_file', side_effect=hanging_copy):
+            result = self.copy(names, ImageSelector.RetryPolicy(retries=1, timeout=1.0, backoff=0.01))
+
+        self.assertEqual((result.copied, len(result.failed)), (39, 1))
+        self.assertLess(max(started[name] for name in names[1:]), 0.9)
+
+    def test_slow_file_with_progress_is_not_timed_out(self):
+        """Test that the timeout counts time without progress, not the total"""
+        def slow_copy(src, dst, heartbeat=None):
+            for _ in range(6):
+                time.sleep(0.05)
+                heartbeat()
+            return self.real_copy_file(src, dst, heartbeat)
+
+        with patch('ImageSelector.copy_file', side_effect=slow_copy):
+            result = self.copy(self.names[:1], ImageSelector.RetryPolicy(retries=0, timeout=0.15))
+
+        self.assertEqual(result.copied, 1)
+        self.assertEqual(result.failed, [])
+
+    def test_hung_copy_does_not_block_exit(self):
+        """Test that an abandoned copy thread cannot keep the process alive"""
+        script = (
+            "import sys, threading; sys.path.insert(0, sys.argv[1]); import ImageSelector; "
+            "ImageSelector.copy_file = lambda src, dst, heartbeat=None: threading.Event().wait(); "
+            "result = ImageSelector.copy_photos(['photo0.jpg'], sys.argv[2], sys.argv[3], "
+            "policy=ImageSelector.RetryPolicy(retries=0, timeout=0.2)); "
+            "assert len(result.failed) == 1"
+        )
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        started = time.monotonic()
+        subprocess.run(
+            [sys.executable, "-c", script, root, self.photo_folder, self.destination_folder],
+            check=True, timeout=30
+        )
+        self.assertLess(time.monotonic() - started, 10)
+
+    def test_failed_copy_leaves_no_partial_file(self):
+        """Test that a copy failing halfway does not leave data in the destination"""
+        def broken_copy(src, dst, heartbeat=None):
+            with open(dst, "w") as f:
+                f.write("half")
+            raise PermissionError(errno.EACCES, "Permission denied")
+
+        with patch('ImageSelector.copy_file', side_effect=broken_copy):
+            self.copy(self.names[:1], ImageSelector.RetryPolicy(retries=0))
+
+        self.assertEqual(os.listdir(self.destination_folder), [])
+
+    def test_circuit_breaker_fails_fast(self):
+        """Test that a dead share stops the run instead of retrying every file"""
+        pauses = []
+        breaker = ImageSelector.CircuitBreaker(threshold=2, cooldown=30, max_trips=1,
+                                               sleep=pauses.append)
+        names = [f"photo{i}.jpg" for i in range(100)]
+        real_stat = os.stat
+        stats = []
+
+        def dead_share_stat(path, *args, **kwargs):
+            if str(path).startswith(self.photo_folder):
+                stats.append(path)
+                raise OSError(errno.EIO, "Input/output error")
+            return real_stat(path, *args, **kwargs)
+
+        with patch('ImageSelector.os.stat', side_effect=dead_share_stat):
+            result = self.copy(names, ImageSelector.RetryPolicy(retries=1, backoff=0.001), breaker)
+
+        self.assertTrue(breaker.broken)
+        self.assertEqual(pauses, [30])
+        self.assertEqual(result.not_found, [])
+        self.assertEqual(len(result.failed), 100)
+        self.assertLess(len(stats), 10)
+
+    def test_stat_errors_are_not_reported_as_missing(self):
+        """Test that an I/O error on stat is retried and then failed, not not_found"""
+        real_stat = os.stat
+
+        def flaky_stat(path, *args, **kwargs):
+            if str(path).endswith("photo0.jpg"):
+                raise OSError(errno.ESTALE, "Stale file handle")
+            return real_stat(path, *args, **kwargs)
+
+        with patch('ImageSelector.os.stat', side_effect=flaky_stat):
+            result = self.copy(self.names, ImageSelector.RetryPolicy(retries=2, backoff=0.001))
+
+        self.assertEqual(result.copied, 3)
+        self.assertEqual(result.not_found, [])
+        self.assertEqual([name for name, _ in result.failed], ["photo0.jpg"])
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+class TestTransformStage(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.photo_folder = os.path.join(self.temp_dir, "photos")
+        self.destination_folder = os.path.join(self.temp_dir, "destination")
+        os.makedirs(os.path.join(self.photo_folder, "sub"))
+        os.makedirs(self.destination_folder)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_output_name_and_cache_key(self):
+        """Test that outputs get the new extension and the key tracks the settings"""
+        settings = ImageSelector.TransformSettings(max_size=200, image_format="webp")
+        self.assertEqual(settings.output_name(os.path.join("sub", "a.png")),
+                         os.path.join("sub", "a.webp"))
+        stat = os.stat(self.photo_folder)
+        other = ImageSelector.TransformSettings(max_size=400, image_format="webp")
+        self.assertNotEqual(settings.cache_key(stat), other.cache_key(stat))
+
+    def test_size_and_quality_are_validated(self):
+        """Test that --max-size and --quality reject values that would skip or break the stage"""
+        for args in (["--max-size", "0"], ["--max-size", "-10"],
+                     ["--quality", "0"], ["--quality", "101"]):
+            with self.subTest(args=args), patch('sys.stderr'):
+                with self.assertRaises(SystemExit):
+                    ImageSelector.parse_args(args)
+        self.assertEqual(ImageSelector.parse_args(["--quality", "100"]).quality, 100)
+
+    def test_output_collisions_are_rejected(self):
+        """Test that a.png and a.jpg cannot both become a.jpg"""
+        csv_file = os.path.join(self.temp_dir, "test.csv")
+        with open(csv_file, "w", encoding='utf-8') as f:
+            f.write("image\na.png\na.jpg\n")
+        options = ImageSelector.parse_args(["--max-size", "100"])
+
+        with self.assertRaises(ValueError):
+            ImageSelector.run_selection(
+                csv_file, self.photo_folder, self.destination_folder, "image", options
+            )
+
+    @unittest.skipUnless(Image, "Pillow is not installed")
+    def test_resize_and_cache(self):
+        """Test that images are resized once and skipped on the rerun"""
+        Image.new("RGB", (800, 600), "red").save(os.path.join(self.photo_folder, "a.jpg"))
+        Image.new("RGBA", (300, 900), "blue").save(os.path.join(self.photo_folder, "sub", "b.png"))
+        names = ["a.jpg", os.path.join("sub", "b.png"), "missing.jpg"]
+        settings = ImageSelector.TransformSettings(max_size=200)
+
+        first = ImageSelector.transform_photos(
+            names, self.photo_folder, self.destination_folder, settings, workers=2
+        )
+        second = ImageSelector.transform_photos(
+            names, self.photo_folder, self.destination_folder, settings, workers=2
+        )
+
+        self.assertEqual((first.copied, first.skipped, first.not_found), (2, 0, ["missing.jpg"]))
+        self.assertEqual((second.copied, second.skipped), (0, 2))
+        with Image.open(os.path.join(self.destination_folder, "sub", "b.jpg")) as image:
+            self.assertEqual((image.format, image.size), ("JPEG", (67, 200)))
+
+    @unittest.skipUnless(Image, "Pillow is not installed")
+    def test_unreadable_image_is_failed(self):
+        """Test that a corrupt source goes to the failed list"""
+        with open(os.path.join(self.photo_folder, "broken.jpg"), "w") as f:
+            f.write("not an image")
+
+        result = ImageSelector.transform_photos(
+            ["broken.jpg"], self.photo_folder, self.destination_folder,
+            ImageSelector.TransformSettings(max_size=100), workers=1
+        )
+
+        self.assertEqual([name for name, _ in result.failed], ["broken.jpg"])
+
+    def test_cache_save_keeps_other_shards_entries(self):
+        """Test that saving the cache merges with what other shards wrote meanwhile"""
+        cache_path = os.path.join(self.destination_folder, ImageSelector.JOURNAL_FOLDER,
+                                  "transform-cache.json")
+        ImageSelector.save_transform_cache(cache_path, {"a.jpg": "1"})
+        ImageSelector.save_transform_cache(cache_path, {"b.jpg": "2"})
+
+        self.assertEqual(ImageSelector.read_transform_cache(cache_path),
+                         {"a.jpg": "1", "b.jpg": "2"})
+        self.assertEqual(os.listdir(os.path.dirname(cache_path)), ["transform-cache.json"])
+
+    @unittest.skipUnless(Image, "Pillow is not installed")
+    def test_failed_save_leaves_no_partial_file(self):
+        """Test that an encoder error does not leave a partial output behind"""
+        Image.new("RGB", (50, 50), "red").save(os.path.join(self.photo_folder, "a.jpg"))
+        settings = ImageSelector.TransformSettings(max_size=10)
+        dst = os.path.join(self.destination_folder, "a.jpg")
+
+        def broken_save(image, path, **kwargs):
+            with open(path, "wb") as f:
+                f.write(b"half")
+            raise OSError("disk full")
+
+        with patch.object(Image.Image, "save", broken_save):
+            status, _, _, _, error = ImageSelector.transform_one(
+                os.path.join(self.photo_folder, "a.jpg"), dst, self.destination_folder, settings, None
+            )
+
+        self.assertEqual((status, error), ("failed", "disk full"))
+        self.assertEqual(os.listdir(self.destination_folder), [])
+
+
+class FakeS3Error(Exception):
+    def __init__(self, code):
+        super().__init__(code)
+        self.response = {"Error": {"Code": code}}
+
+
+class FakeS3Client:
+    """In-process stand-in for the subset of the S3 API used by S3Storage.
+
+    ETags follow S3: the MD5 of the body, or MD5-of-part-MD5s plus "-N" for
+    multipart uploads.
+    """
+
+    def __init__(self):
+        self.objects = {}
+        self.uploads = {}
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def _record(self, name):
+        with self.lock:
+            self.calls.append(name)
+
+    def head_object(self, Bucket, Key):
+        self._record("head_object")
+        if (Bucket, Key) not in self.objects:
+            raise FakeS3Error("404")
+        body, etag = self.objects[(Bucket, Key)]
+        return {"ContentLength": len(body), "ETag": f'"{etag}"'}
+
+    def get_object(self, Bucket, Key):
+        self._record("get_object")
+        if (Bucket, Key) not in self.objects:
+            raise FakeS3Error("NoSuchKey")
+        return {"Body": io.BytesIO(self.objects[(Bucket, Key)][0])}
+
+    def put_object(self, Bucket, Key, Body):
+        self._record("put_object")
+        self.objects[(Bucket, Key)] = (Body, hashlib.md5(Body).hexdigest())
+
+    def create_multipart_upload(self, Bucket, Key):
+        self._record("create_multipart_upload")
+        with self.lock:
+            upload_id = str(len(self.calls))
+            self.uploads[upload_id] = {}
+        return {"UploadId": upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self._record("upload_part")
+        self.uploads[UploadId][PartNumber] = Body
+        return {"ETag": f'"{hashlib.md5(Body).hexdigest()}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        self._record("complete_multipart_upload")
+        uploaded = self.uploads.pop(UploadId)
+        parts = [uploaded[part["PartNumber"]] for part in MultipartUpload["Parts"]]
+        combined = hashlib.md5(b"".join(hashlib.md5(part).digest() for part in parts))
+        self.objects[(Bucket, Key)] = (b"".join(parts), f"{combined.hexdigest()}-{len(parts)}")
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self._record("abort_multipart_upload")
+        self.uploads.pop(UploadId, None)
+
+
+class TestStorageBackends(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.photo_folder = os.path.join(self.temp_dir, "photos")
+        os.makedirs(os.path.join(self.photo_folder, "sub"))
+        self.files = {"small.jpg": b"tiny", os.path.join("sub", "large.jpg"): b"x" * 25}
+        for name, data in self.files.items():
+            with open(os.path.join(self.photo_folder, name), "wb") as f:
+                f.write(data)
+        self.client = FakeS3Client()
+        self.bucket = ImageSelector.S3Storage("photos", "delivery/", client=self.client, part_size=10)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def copy(self, names, source, destination):
+        return ImageSelector.copy_photos(
+            names, source, destination, ImageSelector.ConcurrencyTuner(pinned=4)
+        )
+
+    def test_open_storage(self):
+        """Test that paths and s3:// URLs pick the right backend"""
+        self.assertIsInstance(ImageSelector.open_storage(self.temp_dir), ImageSelector.LocalStorage)
+        self.assertIs(ImageSelector.open_storage(self.bucket), self.bucket)
+        self.assertEqual(self.bucket.key(os.path.join("sub", "a.jpg")), "delivery/sub/a.jpg")
+
+    def test_upload_with_multipart_and_etag_skip(self):
+        """Test uploads to the S3 stand-in and that unchanged objects are skipped"""
+        names = list(self.files) + ["missing.jpg"]
+
+        first = self.copy(names, self.photo_folder, self.bucket)
+        self.client.calls.clear()
+        second = self.copy(names, self.photo_folder, self.bucket)
+
+        self.assertEqual((first.copied, first.not_found), (2, ["missing.jpg"]))
+        self.assertEqual(first.bytes_copied, 29)
+        body, etag = self.client.objects[("photos", "delivery/sub/large.jpg")]
+        self.assertEqual(body, b"x" * 25)
+        self.assertTrue(etag.endswith("-3"))
+        self.assertEqual((second.copied, second.skipped), (0, 2))
+        self.assertNotIn("put_object", self.client.calls)
+        self.assertNotIn("upload_part", self.client.calls)
+
+    def test_changed_object_is_uploaded_again(self):
+        """Test that a different remote ETag triggers a new upload"""
+        self.client.put_object(Bucket="photos", Key="delivery/small.jpg", Body=b"old!")
+        result = self.copy(["small.jpg"], self.photo_folder, self.bucket)
+        self.assertEqual(result.copied, 1)
+        self.assertEqual(self.client.objects[("photos", "delivery/small.jpg")][0], b"tiny")
+
+    def test_download_from_s3(self):
+        """Test that an S3 source can be copied into a local folder"""
+        self.copy(list(self.files), self.photo_folder, self.bucket)
+        destination_folder = os.path.join(self.temp_dir, "destination")
+        os.makedirs(destination_folder)
+
+        result = self.copy(list(self.files) + ["missing.jpg"], self.bucket, destination_folder)
+
+        self.assertEqual((result.copied, result.not_found), (2, ["missing.jpg"]))
+        with open(os.path.join(destination_folder, "sub", "large.jpg"), "rb") as f:
+            self.assertEqual(f.read(), b"x" * 25)
+
+    def test_pool_fits_pinned_workers(self):
+        """Test that the connection pool is as large as a pinned worker count"""
+        csv_file = os.path.join(self.temp_dir, "test.csv")
+        with open(csv_file, "w", encoding='utf-8') as f:
+            f.write("image\nsmall.jpg\n")
+        options = ImageSelector.parse_args(["--workers", "48", "--max-workers", "8"])
+
+        with patch('ImageSelector.open_storage', wraps=ImageSelector.open_storage) as opened:
+            ImageSelector.run_selection(
+                csv_file, self.photo_folder, os.path.join(self.temp_dir, "out"), "image", options
+            )
+
+        self.assertTrue(all(call.args[1] == 48 for call in opened.call_args_list[:2]))
+
+    def test_botocore_network_errors_are_transient(self):
+        """Test that botocore timeouts are retried although they are not OSErrors"""
+        def botocore_error(name):
+            return type(name, (Exception,), {"__module__": "botocore.exceptions"})("down")
+
+        self.assertTrue(ImageSelector.is_transient(botocore_error("ReadTimeoutError")))
+        self.assertTrue(ImageSelector.is_transient(botocore_error("EndpointConnectionError")))
+        self.assertFalse(ImageSelector.is_transient(botocore_error("NoCredentialsError")))
+        self.assertFalse(ImageSelector.is_transient(type("ReadTimeoutError", (Exception,), {})()))
+
+
+class TestRunReport(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.photo_folder = os.path.join(self.temp_dir, "photos")
+        os.makedirs(self.photo_folder)
+        for name in ("photo1.jpg", "locked.jpg"):
+            with open(os.path.join(self.photo_folder, name), "w") as f:
+                f.write("data")
+        self.csv_file = os.path.join(self.temp_dir, "test.csv")
+        with open(self.csv_file, "w", encoding='utf-8') as f:
+            f.write("image;note\nphoto1.jpg;a\nmissing.jpg;b\nlocked.jpg;c\nphoto1.jpg;d\n")
+        self.real_copy_file = ImageSelector.copy_file
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def run_with_report(self, report_name):
+        def copy_or_deny(src, dst, heartbeat=None):
+            if src.endswith("locked.jpg"):
+                raise PermissionError(errno.EACCES, "Permission denied")
+            return self.real_copy_file(src, dst, heartbeat)
+
+        report_path = os.path.join(self.temp_dir, "reports", report_name)
+        options = ImageSelector.parse_args(["--report", report_path])
+        with patch('ImageSelector.copy_file', side_effect=copy_or_deny):
+            ImageSelector.run_selection(self.csv_file, self.photo_folder, self.temp_dir, "image", options)
+        return report_path
+
+    def test_jsonl_report(self):
+        """Test that every image gets one JSON record with its CSV row"""
+        with open(self.run_with_report("run.jsonl"), encoding='utf-8') as f:
+            records = {record["name"]: record for record in map(json.loads, f)}
+
+        self.assertEqual(set(records), {"photo1.jpg", "missing.jpg", "locked.jpg"})
+        self.assertEqual(records["photo1.jpg"]["row"], 2)
+        self.assertEqual(records["photo1.jpg"]["status"], "copied")
+        self.assertEqual(records["photo1.jpg"]["bytes"], 4)
+        self.assertEqual(records["photo1.jpg"]["source"], os.path.join(self.photo_folder, "photo1.jpg"))
+        self.assertEqual(records["missing.jpg"]["status"], "not_found")
+        self.assertEqual(records["locked.jpg"]["status"], "failed")
+        self.assertIn("Permission denied", records["locked.jpg"]["reason"])
+
+    def test_csv_report(self):
+        """Test that a .csv report path produces a CSV with a header"""
+        with open(self.run_with_report("run.csv"), newline='', encoding='utf-8') as f:
+            rows = list(csv.DictReader(f))
+
+        self.assertEqual(list(rows[0]), list(ImageSelector.RunReport.FIELDS))
+        self.assertEqual(
+            sorted((row["row"], row["status"]) for row in rows),
+            [("2", "copied"), ("3", "not_found"), ("4", "failed")]
+        )
+
+
+class TestMultipleReferences(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.csv_file = os.path.join(self.temp_dir, "products.csv")
+        with open(self.csv_file, "w", newline='', encoding='utf-8') as f:
+            writer = csv.writer(f, delimiter=';')
+            writer.writerow(['SKU', 'Image1', 'Image2', 'Image3', 'Gallery'])
+            writer.writerow(['1', 'a.jpg', 'b.jpg', '', 'g1.jpg|g2.jpg'])
+            writer.writerow(['2', 'c.jpg', '', 'a.jpg', 'g2.jpg| g3.jpg |'])
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_column_list_and_pattern(self):
+        """Test that several columns can be given by name or pattern"""
+        self.assertEqual(
+            list(ImageSelector.iter_references(self.csv_file, "image*")),
+            [(2, "a.jpg"), (2, "b.jpg"), (3, "c.jpg"), (3, "a.jpg")]
+        )
+        self.assertEqual(
+            ImageSelector.resolve_columns(['SKU', 'Image1', 'Image2'], "image2, sku"),
+            ['Image2', 'SKU']
+        )
+        with self.assertRaises(ValueError):
+            ImageSelector.resolve_columns(['SKU', 'Image1'], "image1, photo*")
+
+    def test_header_with_comma(self):
+        """Test that a header containing a comma is matched before the answer is split"""
+        fieldnames = ['SKU', 'Foto, principale', 'Foto']
+        self.assertEqual(
+            ImageSelector.resolve_columns(fieldnames, " foto, PRINCIPALE "), ['Foto, principale']
+        )
+        self.assertEqual(ImageSelector.resolve_columns(fieldnames, "foto, sku"), ['Foto', 'SKU'])
+
+    def test_in_cell_separator(self):
+        """Test that a cell listing several images is split"""
+        self.assertEqual(
+            list(ImageSelector.read_photo_names(self.csv_file, "gallery", separator='|')),
+            ["g1.jpg", "g2.jpg", "g3.jpg"]
+        )
+
+    def test_dedupe_keeps_first_row(self):
+        """Test that deduplication keeps the first CSV row of each image"""
+        references = [(2, "a.jpg"), (3, "b.jpg"), (4, "a.jpg")]
+        self.assertEqual(ImageSelector.dedupe_references(references), {"a.jpg": 2, "b.jpg": 3})
+
+    def test_references_are_streamed(self):
+        """Test that rows are expanded lazily while the CSV is read"""
+        references = ImageSelector.iter_references(self.csv_file, "image1, gallery", separator='|')
+        self.assertEqual(next(references), (2, "a.jpg"))
+        self.assertEqual(next(references), (2, "g1.jpg"))
+
+
+class TestWarmStart(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.photo_folder = os.path.join(self.temp_dir, "photos")
+        for folder in ("a", "b"):
+            os.makedirs(os.path.join(self.photo_folder, folder))
+            with open(os.path.join(self.photo_folder, folder, "IMG_0001.jpg"), "w") as f:
+                f.write(folder)
+        self.warm_start_path = os.path.join(self.temp_dir, "state", "warm-start.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_import_defers_heavy_modules(self):
+        """Test that importing the module loads neither tkinter nor the CLI/serialisation modules"""
+        deferred = ["tkinter", "argparse", "logging", "json", "hashlib", "concurrent.futures"]
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        script = (
+            "import sys; sys.path.insert(0, sys.argv[1]); import ImageSelector; "
+            f"print([name for name in {deferred!r} if name in sys.modules])"
+        )
+        output = subprocess.check_output([sys.executable, "-c", script, root], text=True)
+        self.assertEqual(output.strip(), "[]")
+
+    def test_index_rescans_only_changed_folders(self):
+        """Test that a warm refresh only rescans folders whose mtime changed"""
+        cold = ImageSelector.WarmStart(self.warm_start_path)
+        self.assertEqual(cold.photo_index(self.photo_folder).rescanned, 3)
+        cold.save()
+
+        with open(os.path.join(self.photo_folder, "b", "IMG_0002.jpg"), "w") as f:
+            f.write("new")
+        os.utime(os.path.join(self.photo_folder, "b"), ns=(0, 10 ** 18))
+
+        index = ImageSelector.WarmStart(self.warm_start_path).photo_index(self.photo_folder)
+        self.assertEqual(index.rescanned, 1)
+        self.assertIn(os.path.join("b", "IMG_0002.jpg"), index)
+        self.assertNotIn(os.path.join("c", "IMG_0001.jpg"), index)
+
+    def test_missing_images_skip_the_copy(self):
+        """Test that images absent from the index are reported without copying"""
+        csv_file = os.path.join(self.temp_dir, "test.csv")
+        with open(csv_file, "w", encoding='utf-8') as f:
+            f.write("image\na/IMG_0001.jpg\nc/IMG_0001.jpg\n")
+        options = ImageSelector.parse_args(
+            ["--preserve-structure", "--warm-start", self.warm_start_path]
+        )
+
+        with patch('ImageSelector.copy_one', wraps=ImageSelector.copy_one) as copy_one:
+            result = ImageSelector.run_selection(
+                csv_file, self.photo_folder, self.temp_dir, "image", options
+            )
+
+        self.assertEqual(result.copied, 1)
+        self.assertEqual(result.not_found, [os.path.join("c", "IMG_0001.jpg")])
+        self.assertEqual(copy_one.call_count, 1)
+
+    def test_stale_index_miss_is_still_copied(self):
+        """Test that a file missed by an outdated index is found by the normal check"""
+        csv_file = os.path.join(self.temp_dir, "test.csv")
+        with open(csv_file, "w", encoding='utf-8') as f:
+            f.write("image\na/IMG_0001.jpg\na/IMG_0002.jpg\n")
+        options = ImageSelector.parse_args(
+            ["--preserve-structure", "--warm-start", self.warm_start_path]
+        )
+        warm_start = ImageSelector.WarmStart(self.warm_start_path)
+        warm_start.photo_index(self.photo_folder)
+        warm_start.save()
+
+        # A new file whose folder keeps its old mtime, as on a caching network share
+        folder = os.path.join(self.photo_folder, "a")
+        mtime = os.stat(folder).st_mtime_ns
+        with open(os.path.join(folder, "IMG_0002.jpg"), "w") as f:
+            f.write("new")
+        os.utime(folder, ns=(mtime, mtime))
+        destination_folder = os.path.join(self.temp_dir, "out")
+        os.makedirs(destination_folder)
+
+        result = ImageSelector.run_selection(
+            csv_file, self.photo_folder, destination_folder, "image", options
+        )
+
+        self.assertEqual((result.copied, result.not_found), (2, []))
+
+    def test_index_hits_are_not_checked_again(self):
+        """Test that images found in the index go to the copy without another stat"""
+        csv_file = os.path.join(self.temp_dir, "test.csv")
+        with open(csv_file, "w", encoding='utf-8') as f:
+            f.write("image\na/IMG_0001.jpg\nb/IMG_0001.jpg\n")
+        options = ImageSelector.parse_args(
+            ["--preserve-structure", "--warm-start", self.warm_start_path]
+        )
+        destination_folder = os.path.join(self.temp_dir, "out")
+        os.makedirs(destination_folder)
+
+        with patch('ImageSelector.LocalStorage.exists') as exists:
+            result = ImageSelector.run_selection(
+                csv_file, self.photo_folder, destination_folder, "image", options
+            )
+
+        self.assertEqual(result.copied, 2)
+        exists.assert_not_called()
+
+    def test_stale_index_hit_is_reported_missing(self):
+        """Test that a file deleted behind an unchanged folder mtime is not found, not failed"""
+        csv_file = os.path.join(self.temp_dir, "test.csv")
+        with open(csv_file, "w", encoding='utf-8') as f:
+            f.write("image\na/IMG_0001.jpg\n")
+        options = ImageSelector.parse_args(
+            ["--preserve-structure", "--warm-start", self.warm_start_path]
+        )
+        warm_start = ImageSelector.WarmStart(self.warm_start_path)
+        warm_start.photo_index(self.photo_folder)
+        warm_start.save()
+        folder = os.path.join(self.photo_folder, "a")
+        mtime = os.stat(folder).st_mtime_ns
+        os.remove(os.path.join(folder, "IMG_0001.jpg"))
+        os.utime(folder, ns=(mtime, mtime))
+        destination_folder = os.path.join(self.temp_dir, "out")
+        os.makedirs(destination_folder)
+
+        result = ImageSelector.run_selection(
+            csv_file, self.photo_folder, destination_folder, "image", options
+        )
+
+        self.assertEqual((result.not_found, result.failed), ([os.path.join("a", "IMG_0001.jpg")], []))
+
+    @patch('ImageSelector.tk.Tk')
+    @patch('ImageSelector.messagebox.showerror')
+    @patch('ImageSelector.simpledialog.askstring')
+    @patch('ImageSelector.filedialog.askdirectory')
+    @patch('ImageSelector.filedialog.askopenfilename')
+    def test_dialogs_start_from_last_selection(self, mock_open_file, mock_ask_dir,
+                                              mock_ask_string, mock_error, mock_tk):
+        """Test that --warm-start remembers and offers the previous answers"""
+        warm_start = ImageSelector.WarmStart(self.warm_start_path)
+        warm_start.selections.update(
+            csv_file="/data/last.csv", photo_folder="/data/photos",
+            destination_folder="/data/out", file_name_column="Image"
+        )
+        warm_start.save()
+        mock_open_file.return_value = ""
+
+        ImageSelector.main(["--warm-start", self.warm_start_path])
+
+        mock_open_file.assert_called_once_with(
+            title="Select the CSV file", filetypes=[("CSV files", "*.csv")], initialdir="/data"
+        )
+
+
+class TestSyncMode(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.photo_folder = os.path.join(self.temp_dir, "photos")
+        self.destination_folder = os.path.join(self.temp_dir, "destination")
+        os.makedirs(self.photo_folder)
+        os.makedirs(self.destination_folder)
+        for name in ("a.jpg", "b.jpg", "c.jpg"):
+            self.write(os.path.join(self.photo_folder, name), name)
+        self.csv_file = os.path.join(self.temp_dir, "test.csv")
+        with open(self.csv_file, "w", encoding='utf-8') as f:
+            f.write("image\na.jpg\nb.jpg\nc.jpg\n")
+        ImageSelector.run_selection(
+            self.csv_file, self.photo_folder, self.destination_folder, "image"
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def write(self, path, data):
+        with open(path, "w") as f:
+            f.write(data)
+
+    def sync(self, *args, confirm=None):
+        options = ImageSelector.parse_args(["--sync", *args])
+        return ImageSelector.run_selection(
+            self.csv_file, self.photo_folder, self.destination_folder, "image", options,
+            confirm=confirm
+        )
+
+    def test_only_new_and_changed_images_are_copied(self):
+        """Test that a rerun copies only what differs in size or mtime"""
+        self.write(os.path.join(self.photo_folder, "a.jpg"), "a.jpg, edited")
+        os.remove(os.path.join(self.destination_folder, "b.jpg"))
+
+        with patch('ImageSelector.copy_one', wraps=ImageSelector.copy_one) as copy_one:
+            result = self.sync()
+
+        self.assertEqual(sorted(result.sync_plan.changed), ["a.jpg"])
+        self.assertEqual(result.sync_plan.new, ["b.jpg"])
+        self.assertEqual(result.sync_plan.unchanged, ["c.jpg"])
+        self.assertEqual((result.copied, result.skipped), (2, 1))
+        self.assertEqual(copy_one.call_count, 2)
+
+    def test_hash_comparison_ignores_mtime(self):
+        """Test that --sync-hash treats a touched but identical file as unchanged"""
+        os.utime(os.path.join(self.photo_folder, "a.jpg"), ns=(0, 10 ** 18))
+        self.write(os.path.join(self.destination_folder, "c.jpg"), "c.jpX")
+
+        self.assertEqual(self.sync().sync_plan.changed, ["a.jpg"])
+        os.utime(os.path.join(self.photo_folder, "a.jpg"), ns=(0, 2 * 10 ** 18))
+        plan = self.sync("--sync-hash").sync_plan
+        self.assertEqual(plan.changed, ["c.jpg"])
+
+    def test_prune_quarantines_images_not_in_csv(self):
+        """Test that images dropped from the CSV are moved to the quarantine"""
+        self.write(os.path.join(self.destination_folder, "old.jpg"), "old")
+        self.write(os.path.join(self.destination_folder, "notes.txt"), "keep me")
+
+        result = self.sync("--prune", "quarantine")
+
+        self.assertEqual(result.sync_plan.extra, ["old.jpg"])
+        self.assertFalse(os.path.exists(os.path.join(self.destination_folder, "old.jpg")))
+        self.assertTrue(os.path.exists(os.path.join(self.destination_folder, "notes.txt")))
+        quarantine = os.path.join(self.destination_folder, ".imageselector", "quarantine")
+        (stamp,) = os.listdir(quarantine)
+        self.assertEqual(os.listdir(os.path.join(quarantine, stamp)), ["old.jpg"])
+
+    def test_prune_keeps_listed_images_without_source(self):
+        """Test that an image still in the CSV is not pruned when its source is gone"""
+        os.remove(os.path.join(self.photo_folder, "b.jpg"))
+        warm_start_path = os.path.join(self.temp_dir, "warm-start.json")
+
+        result = self.sync("--prune", "remove", "--warm-start", warm_start_path)
+
+        self.assertEqual(result.sync_plan.extra, [])
+        self.assertEqual(result.not_found, ["b.jpg"])
+        self.assertTrue(os.path.exists(os.path.join(self.destination_folder, "b.jpg")))
+
+    def test_declined_plan_changes_nothing(self):
+        """Test that the diff is offered before anything is copied or removed"""
+        self.write(os.path.join(self.destination_folder, "old.jpg"), "old")
+        os.remove(os.path.join(self.destination_folder, "b.jpg"))
+        plans = []
+
+        result = self.sync("--prune", "remove", confirm=lambda plan: plans.append(plan) or False)
+
+        self.assertTrue(result.cancelled)
+        self.assertIn("1 new", plans[0].summary())
+        self.assertIn("1 images not in the CSV will be removed", plans[0].summary())
+        self.assertEqual(sorted(os.listdir(self.destination_folder)), ["a.jpg", "c.jpg", "old.jpg"])
+
+    def test_sync_requires_local_source(self):
+        """Test that --sync is refused for a source it cannot stat, such as S3"""
+        options = ImageSelector.parse_args(["--sync"])
+        bucket = ImageSelector.S3Storage("photos", client=FakeS3Client())
+        with self.assertRaises(ValueError):
+            ImageSelector.run_selection(
+                self.csv_file, bucket, self.destination_folder, "image", options
+            )
+
+    def test_prune_requires_sync(self):
+        """Test that --prune is refused without --sync"""
+        options = ImageSelector.parse_args(["--prune", "remove"])
+        with self.assertRaises(ValueError):
+            ImageSelector.run_selection(
+                self.csv_file, self.photo_folder, self.destination_folder, "image", options
+            )
+
+
 if __name__ == "__main__":
     unittest.main()